@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmark for the (AHN) downloader. Runs downloader.run against a local stand-in for the AHN server
+serving synthetic tiles, and stores the results so regressions between versions show up.
+
+
+"""
+
+
+
+import argparse, time, sys, os, json, random, tempfile, shutil, subprocess, resource, contextlib, multiprocessing
+import http.server
+import email.utils as eut
+import numpy as np
+
+import downloader
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="""Benchmarks the downloader against a local fake AHN server with synthetic .laz.zip tiles.
+    A cold sync (everything downloaded) is followed by a warm sync (nothing changed, probes only).""")
+
+    parser.add_argument('-n','--tiles',default=None,help='number of tiles taken from the TOP10NL tile list; default is all',type=int)
+    parser.add_argument('--tilesize',default=2.,help='mean synthetic tile size in MB; default is 2',type=float)
+    parser.add_argument('--sizejitter',default=0.5,help='relative spread of the tile sizes; default is 0.5',type=float)
+    parser.add_argument('--latency',default=0.02,help='server latency per request in seconds; default is 0.02',type=float)
+    parser.add_argument('--bandwidth',default=None,help='bandwidth cap per connection in MB/s; default is unlimited',type=float)
+    parser.add_argument('--failrate',default=0.,help='fraction of requests answered with 503; default is 0',type=float)
+    parser.add_argument('--droprate',default=0.,help='fraction of downloads whose connection is dropped halfway; default is 0',type=float)
+    parser.add_argument('--seed',default=0,help='random seed for tile sizes and injected failures; default is 0',type=int)
+    parser.add_argument('-p','--proc',default=8,help='number of downloader workers; default is 8',type=int)
+    parser.add_argument('--segments',default=1,help='passed on to the downloader; default is 1',type=int)
+    parser.add_argument('--segmentthreshold',default=512,help='passed on to the downloader, in MB; default is 512',type=float)
+    parser.add_argument('--results',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'benchmark_results.jsonl'),help='file the results are appended to; default is benchmark_results.jsonl next to this script')
+    parser.add_argument('--tolerance',default=0.1,help='relative slowdown against the previous comparable result reported as a regression; default is 0.1',type=float)
+    parser.add_argument('-v','--verbose',action='store_true',help='show the output of the downloader')
+    return parser
+
+
+
+class FakeAHNHandler(http.server.BaseHTTPRequestHandler):
+    """Serves synthetic tiles with Last-Modified/ETag, conditional requests, ranges, latency, bandwidth caps and failures."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.serve_tile(False)
+
+    def do_GET(self):
+        self.serve_tile(True)
+
+    def send_empty(self, status, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def serve_tile(self, sendBody):
+        server = self.server
+        time.sleep(server.latency)
+        with server.requestCount.get_lock():
+            server.requestCount.value += 1
+
+        tileName = self.path.lstrip('/')
+        if tileName not in server.tileSizes:
+            self.send_empty(404)
+            return
+        if server.random.random() < server.failRate:
+            self.send_empty(503, {'Retry-After':'0'})
+            return
+
+        size = server.tileSizes[tileName]
+        etag = '"{}-{}-{}"'.format(tileName, size, int(server.lastModified))
+        lastModified = eut.formatdate(server.lastModified, usegmt=True)
+        validators = {'ETag':etag, 'Last-Modified':lastModified, 'Accept-Ranges':'bytes'}
+
+        ifNoneMatch = self.headers['If-None-Match']
+        ifModifiedSince = self.headers['If-Modified-Since']
+        if (ifNoneMatch != None and ifNoneMatch == etag) or (ifNoneMatch == None and ifModifiedSince == lastModified):
+            self.send_empty(304, validators)
+            return
+
+        start, end = 0, size
+        rangeHeader = self.headers['Range']
+        if rangeHeader != None and self.headers['If-Range'] in (None, etag, lastModified):
+            first, sep, last = rangeHeader.partition('=')[2].partition('-')
+            start = int(first)
+            end = min(int(last)+1, size) if last else size
+            if start >= size:
+                self.send_empty(416, {'Content-Range':'bytes */{}'.format(size)})
+                return
+            self.send_response(206)
+            self.send_header('Content-Range','bytes {}-{}/{}'.format(start, end-1, size))
+        else:
+            self.send_response(200)
+        for name, value in validators.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length',str(end-start))
+        self.end_headers()
+
+        if sendBody:
+            dropAt = (start+end)//2 if server.random.random() < server.dropRate else None
+            self.send_body(tileName, start, end, dropAt)
+
+    def send_body(self, tileName, start, end, dropAt):
+        #tile content is a seeded block repeated from a tile specific offset, so nothing is kept per tile
+        block = self.server.block
+        tileOffset = hash(tileName) % len(block)
+        chunkSize = 256*1024
+        offset = start
+        while offset < end:
+            chunkEnd = min(offset+chunkSize, end, dropAt if dropAt != None else end)
+            if chunkEnd <= offset:
+                #injected failure: cut the connection halfway
+                self.close_connection = True
+                return
+            blockStart = (offset+tileOffset) % len(block)
+            chunk = (block[blockStart:]+block)[:chunkEnd-offset]
+            chunkStart = time.monotonic()
+            self.wfile.write(chunk)
+            with self.server.bytesSent.get_lock():
+                self.server.bytesSent.value += len(chunk)
+            offset = chunkEnd
+            if self.server.bandwidth != None:
+                #every chunk is paced on its own: time lost to a slow reader is not made up with a burst afterwards
+                remaining = len(chunk)/self.server.bandwidth-(time.monotonic()-chunkStart)
+                if remaining > 0:
+                    time.sleep(remaining)
+
+
+def serve_fake_ahn(port, tileSizes, options, requestCount, bytesSent, ready):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), FakeAHNHandler)
+    server.daemon_threads = True
+    server.tileSizes = tileSizes
+    server.latency = options['latency']
+    server.bandwidth = options['bandwidth']*1024*1024 if options['bandwidth'] != None else None
+    server.failRate = options['failrate']
+    server.dropRate = options['droprate']
+    server.lastModified = options['lastModified']
+    server.random = random.Random(options['seed'])
+    server.block = random.Random(options['seed']).randbytes(1024*1024)
+    server.requestCount = requestCount
+    server.bytesSent = bytesSent
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def synthetic_tile_sizes(mapTiles, suffix, meanSize, jitter, seed):
+    sizeRandom = random.Random(seed)
+    meanBytes = meanSize*1024*1024
+    return {downloader.build_filename(mapTile, suffix):max(1, int(meanBytes*(1+jitter*(2*sizeRandom.random()-1)))) for mapTile in mapTiles}
+
+
+def latency_percentiles(seconds):
+    if len(seconds) == 0:
+        return {'p50':None, 'p90':None, 'p99':None}
+    return {'p'+str(p):float(np.percentile(seconds, p))*1000. for p in (50, 90, 99)}
+
+
+def run_phase(name, repositoryDir, baseurl, suffix, mapTiles, args, requestCount, bytesSent):
+    requestsBefore, bytesBefore = requestCount.value, bytesSent.value
+
+    output = sys.stdout if args.verbose else open(os.devnull,'w')
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            downloader.run(repositoryDir, repositoryDir, baseurl, suffix, args.proc, 'bench-'+name, inputList=mapTiles,
+                           segments=args.segments, segmentThreshold=args.segmentthreshold)
+    finally:
+        elapsed = time.perf_counter()-t0
+        if output is not sys.stdout:
+            output.close()
+
+    with open(os.path.join(repositoryDir, 'downloadList-bench-{}-latest.js'.format(name)),'r') as dlfile:
+        manifest = json.load(dlfile)
+    transferred = bytesSent.value-bytesBefore
+    #the downloader keeps the seconds spent per stage with every tile
+    stageTimes = lambda stage: [results[-1]['timings'][stage] for results in manifest.values() if stage in results[-1].get('timings', {})]
+
+    return {'seconds':elapsed,
+            'tiles':len(manifest),
+            'downloaded':sum(1 for results in manifest.values() if results[1] and results[2]),
+            'failed':sum(1 for results in manifest.values() if downloader.tile_failed(results)),
+            'requests':requestCount.value-requestsBefore,
+            'megabytes':transferred/1024./1024.,
+            'tilesPerSecond':len(manifest)/elapsed,
+            'megabytesPerSecond':transferred/1024./1024./elapsed,
+            'probeLatencyMs':latency_percentiles(stageTimes('probe')),
+            'firstByteLatencyMs':latency_percentiles(stageTimes('firstByte'))}
+
+
+def code_version():
+    try:
+        return subprocess.check_output(['git','describe','--always','--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare_with_previous(record, resultsPath, tolerance):
+
+    #the most recent earlier result with identical parameters is the baseline
+    previous = None
+    if os.path.isfile(resultsPath):
+        with open(resultsPath,'r') as resultsfile:
+            for line in resultsfile:
+                try:
+                    candidate = json.loads(line)
+                except ValueError:
+                    continue
+                if candidate['parameters'] == record['parameters']:
+                    previous = candidate
+    if previous == None:
+        print('no earlier result with the same parameters to compare with')
+        return
+
+    print('compared with {} ({}):'.format(previous['version'], previous['date']))
+    for phase in ('cold', 'warm'):
+        for metric in ('tilesPerSecond', 'megabytesPerSecond'):
+            before, now = previous[phase][metric], record[phase][metric]
+            if before > 0:
+                change = (now-before)/before
+                flag = '  REGRESSION' if change < -tolerance else ''
+                print('  {} {}: {:.2f} -> {:.2f} ({:+.1%}){}'.format(phase, metric, before, now, change, flag))
+
+
+def report(name, phase):
+    probes = phase['probeLatencyMs']
+    print('{:5s} {:5d} tiles in {:7.2f} s  {:8.2f} tiles/s  {:8.2f} MB/s  {:5d} downloaded  {:3d} failed  {:6d} requests  probe p50/p90/p99 {} ms'.format(
+        name, phase['tiles'], phase['seconds'], phase['tilesPerSecond'], phase['megabytesPerSecond'], phase['downloaded'], phase['failed'], phase['requests'],
+        '/'.join('{:.1f}'.format(probes[p]) if probes[p] != None else '-' for p in ('p50','p90','p99'))))
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    suffix = '.laz.zip'
+    mapTiles = downloader.download_list_top10nl()
+    if args.tiles != None:
+        mapTiles = mapTiles[:args.tiles]
+    tileSizes = synthetic_tile_sizes(mapTiles, suffix, args.tilesize, args.sizejitter, args.seed)
+
+    options = {'latency':args.latency, 'bandwidth':args.bandwidth, 'failrate':args.failrate, 'droprate':args.droprate,
+               'seed':args.seed, 'lastModified':time.time()-86400}
+    requestCount = multiprocessing.Value('l', 0)
+    bytesSent = multiprocessing.Value('q', 0)
+    ready = multiprocessing.Queue()
+    serverProcess = multiprocessing.Process(target=serve_fake_ahn, args=(0, tileSizes, options, requestCount, bytesSent, ready), daemon=True)
+    serverProcess.start()
+    baseurl = 'http://127.0.0.1:{}/'.format(ready.get())
+
+    repositoryDir = tempfile.mkdtemp(prefix='downloadAHN-bench-')
+    print('benchmarking {} tiles ({:.1f} MB) with {} workers against {}'.format(len(mapTiles), sum(tileSizes.values())/1024./1024., args.proc, baseurl))
+    try:
+        cold = run_phase('cold', repositoryDir, baseurl, suffix, mapTiles, args, requestCount, bytesSent)
+        report('cold', cold)
+        warm = run_phase('warm', repositoryDir, baseurl, suffix, mapTiles, args, requestCount, bytesSent)
+        report('warm', warm)
+    finally:
+        serverProcess.terminate()
+        shutil.rmtree(repositoryDir, ignore_errors=True)
+
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+    print('peak memory of the downloader process: {:.1f} MB'.format(peakMemory))
+
+    parameters = {name:value for name, value in vars(args).items() if name not in ('results', 'tolerance', 'verbose')}
+    record = {'version':code_version(), 'date':time.strftime('%Y-%m-%dT%H:%M:%S'), 'python':sys.version.split()[0],
+              'parameters':parameters, 'cold':cold, 'warm':warm, 'peakMemoryMB':peakMemory}
+    compare_with_previous(record, args.results, args.tolerance)
+    with open(args.results,'a') as resultsfile:
+        resultsfile.write(json.dumps(record)+'\n')
+    print('results appended to {}'.format(args.results))
+
+
+
+
+if __name__ == "__main__":
+    main()
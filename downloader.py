@@ -9,31 +9,321 @@ Downloader for (AHN) datasets. Used with eEcoLiDAR project
 
 
 
-import argparse, time, traceback, sys, os, shutil, multiprocessing, json
-import urllib.request
+import argparse, time, traceback, sys, os, shutil, json, threading, itertools, hashlib, base64, random, heapq, queue, struct, zlib
+import collections
+import concurrent.futures
+import errno
+try:
+    import fcntl
+except ImportError:
+    #not on Windows; the reflink copy strategy is then unsupported
+    fcntl = None
+import glob
+import re
+import sqlite3
+import zipfile
+import http.client
+import urllib.parse
 import datetime
 import email.utils as eut
+import xml.etree.ElementTree as ET
 import numpy as np
 
 
+RESPONSE_DRAIN_LIMIT = 64*1024
+DOWNLOAD_CHUNK_SIZE = 1024*1024
+REQUEST_RETRIES = 3
+BACKOFF_BASE = 1.
+BACKOFF_CAP = 300.
+TILE_BACKOFF_BASE = 5.
+SEGMENT_STATE_INTERVAL = 64*1024*1024
+COPY_CHUNK_SIZE = 1024*1024*1024
+FICLONE = 0x40049409
+UNSUPPORTED_COPY_ERRNOS = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EPERM, errno.EMLINK)
+EXTRACT_QUEUE_CHUNKS = 16
+EXTRACT_BACKLOG_POLL = 0.5
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LAS_HEADER_SIZE = 375
+#TOP10NL sheets are 40 x 25 km in RD New. A-D are the quadrants of the western half, E-H of the eastern half
+#(NW, NE, SW, SE); each quadrant is split into a northern (N) and southern (Z) half, each half into a western (1) and eastern (2) tile
+SHEET_WIDTH = 40000.
+SHEET_HEIGHT = 25000.
+SHEET_LETTERS = 'ABCDEFGH'
+TILE_WIDTH = 5000.
+TILE_HEIGHT = 6250.
+LISTING_ANCHOR = re.compile(r'<a\s[^>]*?href=["\']([^"\'?#]+)["\'][^>]*>.*?</a>(.*?)(?=<a\s|$)', re.IGNORECASE | re.DOTALL)
+LISTING_DATE = re.compile(r'(\d{1,2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2}(?::\d{2})?|\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2})?)')
+LISTING_SIZE = re.compile(r'(?:\s|&nbsp;)*(\d+(?:\.\d+)?)([KMGT]?)(?![\w.])')
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+workerState = threading.local()
+
+
 def argument_parser():
     parser = argparse.ArgumentParser(description="""This script checks compares a local repository of (AHN .LAZ) point cloud data fileas against
     the online AHN repository and downloads any new or updated files. Can be run on a single machine or in distributrd fashion across multiple VMs.
     Division of labour is handeled internally and reproducibly.""")
 
-    parser.add_argument('-l','--localrepository',default='', help='path to local repository', type=str, required=True)
+    parser.add_argument('-l','--localrepository',default=None, help='path to local repository; required unless merging', type=str)
     parser.add_argument('-o','--outputdirectory',default='.',help='full path of desired output directory; download destination',type=str, required=True)
-    parser.add_argument('-u','--baseurl',default='',help='common base url of files to be downloaded',type=str, required=True)
+    parser.add_argument('-u','--baseurl',default=None,help='common base url of files to be downloaded; required unless merging',type=str)
     parser.add_argument('-s','--suffix',default=None,help='common suffix of files to be downloaded. Optional if included in other fashion, e.g. in filename',type=str)
-    parser.add_argument('-p','--proc',default=1,help='number of processes; default is 1',type=int)
+    parser.add_argument('-p','--proc',default=1,help='number of concurrent tile workers (threads sharing keep-alive connections); default is 1',type=int)
+    parser.add_argument('--localindex',default=None,help='path of the SQLite index of the local repository (name, size, mtime). Default is localIndex.sqlite in the output directory; keep it on a local disk if that is a network mount',type=str)
+    parser.add_argument('--reindex',action='store_true',help='stat every file of the local repository again, e.g. after files were modified in place')
+    parser.add_argument('--segments',default=1,help='number of byte ranges a large tile is split into and fetched concurrently; default is 1 (single stream)',type=int)
+    parser.add_argument('--segmentthreshold',default=512,help='minimum tile size in MB for a segmented download; default is 512',type=float)
+    parser.add_argument('--resume',default=None,help='tag of an interrupted run to continue. Tiles its journal records as done are skipped')
+    parser.add_argument('--shard',default=None,help='i/N: process only shard i (0 <= i < N) of the tile list. All nodes must use the same tag and tile list')
+    parser.add_argument('--sharddir',default=None,help='shared directory for claim lock files. With --shard, nodes that finish early steal unclaimed tiles of other shards',type=str)
+    parser.add_argument('--merge',default=None,nargs='+',help='merge the downloadList-<tag>-*.js manifests found in these directories (or these files) into downloadList-<tag>-merged.js in the output directory, then exit')
+    parser.add_argument('--maxrate',default=None,help='maximum number of requests per second across all workers; default is unlimited',type=float)
+    parser.add_argument('--maxbandwidth',default=None,help='maximum download rate in MB/s across all workers; default is unlimited',type=float)
+    parser.add_argument('--retries',default=3,help='number of times a failed tile is retried with exponential backoff; default is 3',type=int)
+    parser.add_argument('--perhost',default=None,help='maximum number of concurrent connections per host, shared by tile workers and segments; default is the number of workers, times --segments when segmenting',type=int)
     parser.add_argument('-i','--inputlist',default=None,help='optional input list')
     parser.add_argument('-c','--copylocal',default='False',help='Flag [True,False]. if true up-to-date files from local repository will be copied to output directory')
-    parser.add_argument('-t','--tag',default=str(np.random.randint(200000)),help='unique run identifier. If not set a string representation of a random integer in [0,199999) is used.')
+    parser.add_argument('--copystrategy',default='auto',choices=['auto']+[strategy[0] for strategy in COPY_STRATEGIES],help='how up-to-date files are copied from the local repository: reflink, copyrange (copy_file_range), sendfile, copy or hardlink. auto uses the cheapest one that works but never hardlink, whose output files share their inode with the local repository; default is auto')
+    parser.add_argument('--copyworkers',default=4,help='number of copy workers running next to the download workers; default is 4',type=int)
+    parser.add_argument('--extract',action='store_true',help='unzip the .laz of every downloaded or copied tile into the output directory, while it streams in where possible, and validate its LAS header')
+    parser.add_argument('--extractworkers',default=2,help='number of extract workers running next to the download workers; default is 2',type=int)
+    parser.add_argument('-t','--tag',default=None,help='unique run identifier. If not set a string representation of a random integer in [0,199999) is used. Required with --merge')
+    parser.add_argument('--discover',action='store_true',help='fetch the remote directory listing (HTML index or Atom feed) once and only process tiles that are new or changed according to it. Without an input list or region all listed tiles are considered')
+    parser.add_argument('--listingurl',default=None,help='url of the remote directory listing or Atom feed; default is the base url',type=str)
+    parser.add_argument('--bbox',default=None,help='xmin,ymin,xmax,ymax in RD New (EPSG:28992): only the TOP10NL tiles intersecting this box. Requires --sheetindex',type=str)
+    parser.add_argument('--polygon',default=None,help='GeoJSON file with a (multi)polygon in RD New: only the TOP10NL tiles intersecting it. Requires --sheetindex',type=str)
+    parser.add_argument('--sheetindex',default=None,help='JSON file mapping TOP10NL sheet numbers to the [xmin, ymin] of the 40x25 km sheet in RD New',type=str)
+    parser.add_argument('-r','--remotecache',default=None,help='path of the remote metadata cache (size, ETag, Last-Modified per tile). Default is remoteMetadataCache.js in the output directory',type=str)
     return parser
 
 
+class RetryableError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token buckets for requests/s and bytes/s shared by all workers, plus a common pause after throttling."""
+
+    def __init__(self, requestsPerSecond=None, bytesPerSecond=None):
+        self.requestsPerSecond = requestsPerSecond
+        self.bytesPerSecond = bytesPerSecond
+        self.lock = threading.Lock()
+        #buckets start full and hold at most one second worth of tokens
+        self.requestTokens = requestsPerSecond
+        self.byteTokens = bytesPerSecond
+        self.lastRefill = time.monotonic()
+        self.pausedUntil = 0.
+
+    def pause(self, seconds):
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, time.monotonic()+seconds)
+
+    def acquire(self, requests=0, nbytes=0):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now-self.lastRefill
+            self.lastRefill = now
+            wait = self.pausedUntil-now
+            #tokens may go negative; the debt is paid by waiting, so large chunks do not starve
+            if self.requestsPerSecond != None and requests > 0:
+                self.requestTokens = min(self.requestsPerSecond, self.requestTokens+elapsed*self.requestsPerSecond)-requests
+                wait = max(wait, -self.requestTokens/self.requestsPerSecond)
+            if self.bytesPerSecond != None and nbytes > 0:
+                self.byteTokens = min(self.bytesPerSecond, self.byteTokens+elapsed*self.bytesPerSecond)-nbytes
+                wait = max(wait, -self.byteTokens/self.bytesPerSecond)
+        if wait > 0:
+            time.sleep(wait)
+
+
+def backoff_delay(attempt, retryAfter=None, base=None):
+
+    #exponential backoff with jitter, never shorter than what the server asked for
+    if base == None:
+        base = BACKOFF_BASE
+    ceiling = min(BACKOFF_CAP, base*2**attempt)
+    delay = ceiling/2.+random.uniform(0, ceiling/2.)
+    if retryAfter != None:
+        delay = max(delay, retryAfter)
+    return delay
+
+
+def parse_retry_after(retryAfter):
+
+    if retryAfter == None:
+        return None
+    if retryAfter.strip().isdigit():
+        return float(retryAfter)
+    try:
+        retryDate = eut.parsedate_to_datetime(retryAfter)
+    except (TypeError, ValueError):
+        return None
+    return max(0., (retryDate-datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared by all tile workers, capped per host."""
+
+    def __init__(self, maxPerHost, timeout=60, limiter=None):
+        self.maxPerHost = maxPerHost
+        self.timeout = timeout
+        self.limiter = limiter if limiter != None else RateLimiter()
+        self.lock = threading.Lock()
+        self.idleConnections = {}
+        self.hostSlots = {}
+
+    def host_slot(self, hostKey):
+        with self.lock:
+            if hostKey not in self.hostSlots:
+                self.hostSlots[hostKey] = threading.BoundedSemaphore(self.maxPerHost)
+            return self.hostSlots[hostKey]
+
+    def new_connection(self, hostKey):
+        scheme, netloc = hostKey
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def get_connection(self, hostKey):
+        with self.lock:
+            idle = self.idleConnections.get(hostKey)
+            if idle:
+                return idle.pop(), True
+        return self.new_connection(hostKey), False
+
+    def put_connection(self, hostKey, connection):
+        with self.lock:
+            self.idleConnections.setdefault(hostKey, []).append(connection)
+
+    def send(self, hostKey, method, path, headers):
+        connection, reused = self.get_connection(hostKey)
+        try:
+            connection.request(method, path, headers=headers)
+            return connection, connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+        #the server dropped an idle keep-alive connection; retry once on a fresh one
+        connection = self.new_connection(hostKey)
+        connection.request(method, path, headers=headers)
+        return connection, connection.getresponse()
+
+    def open(self, method, url, headers={}, maxRedirects=5):
+        attempt = 0
+        while True:
+            try:
+                response = self.open_once(method, url, headers, maxRedirects)
+            except (TimeoutError, ConnectionError) as e:
+                if attempt >= REQUEST_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                print('{} for {}. retrying in {:.1f} seconds'.format(e, url, delay))
+                time.sleep(delay)
+            else:
+                if response.status not in (429, 503) or attempt >= REQUEST_RETRIES:
+                    return response
+                response.release()
+                #the server asks everyone to slow down, so the pause is shared by all workers
+                delay = backoff_delay(attempt, parse_retry_after(response.headers['Retry-After']))
+                print('HTTP Error {} for {}. pausing requests for {:.1f} seconds'.format(response.status, url, delay))
+                self.limiter.pause(delay)
+            attempt += 1
+
+    def open_once(self, method, url, headers, maxRedirects):
+        for i in range(maxRedirects+1):
+            splitUrl = urllib.parse.urlsplit(url)
+            hostKey = (splitUrl.scheme, splitUrl.netloc)
+            path = splitUrl.path or '/'
+            if splitUrl.query:
+                path += '?'+splitUrl.query
+
+            self.limiter.acquire(requests=1)
+            slot = self.host_slot(hostKey)
+            slot.acquire()
+            try:
+                connection, response = self.send(hostKey, method, path, headers)
+            except:
+                slot.release()
+                raise
+            pooledResponse = PooledResponse(self, hostKey, connection, response)
+
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location != None and i < maxRedirects:
+                pooledResponse.release()
+                url = urllib.parse.urljoin(url, location)
+                if response.status == 303 and method != 'HEAD':
+                    method = 'GET'
+            else:
+                return pooledResponse
+
+    def close(self):
+        with self.lock:
+            for idle in self.idleConnections.values():
+                for connection in idle:
+                    connection.close()
+            self.idleConnections = {}
+
+
+class PooledResponse:
+    """HTTP response that hands its connection back to the pool when released."""
+
+    def __init__(self, pool, hostKey, connection, response):
+        self.pool = pool
+        self.hostKey = hostKey
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.released = False
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.pool.limiter.acquire(nbytes=len(data))
+        return data
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        #small leftovers are drained so the connection stays reusable, large ones are not worth it
+        try:
+            if not self.response.isclosed() and (self.response.length == None or self.response.length <= RESPONSE_DRAIN_LIMIT):
+                self.response.read()
+        except (OSError, http.client.HTTPException):
+            pass
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put_connection(self.hostKey, self.connection)
+        else:
+            self.connection.close()
+        self.pool.host_slot(self.hostKey).release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
 
-def build_file_identifiers(inputItem,baseurl,suffix)
+
+class DownloadSession:
+    """Shared state of one run, handed to every tile worker."""
+
+    def __init__(self, pool, remoteCache, localIndex=None, segments=1, segmentThreshold=None):
+        self.pool = pool
+        self.remoteCache = remoteCache
+        self.localIndex = localIndex
+        self.segments = segments
+        self.segmentThreshold = segmentThreshold
+        self.claimDir = None
+        self.nodeId = None
+        self.copyStrategy = 'auto'
+        self.unsupportedCopyStrategies = set()
+        self.extractExecutor = None
+        self.extractSlots = None
+
+
+
+def build_file_identifiers(inputItem,baseurl,suffix):
     filename = build_filename(inputItem,suffix)
     url = build_url(baseurl,filename)
     return filename, url
@@ -42,7 +332,7 @@ def build_filename(top10nlMapTile, suffix):
     if suffix != None:
         filename=top10nlMapTile.lower()+suffix
     else:
-        top10nlMapTile.lower()
+        filename=top10nlMapTile.lower()
     return filename
 
 
@@ -51,75 +341,511 @@ def build_url(baseurl,top10nlMapTileFileName):
     return url
 
 
-def check_local(top10nlMapTile,localFilesPath, suffix):
+def update_local_index(localFilesPath, localIndexPath, reindex=False):
+
+    connection = sqlite3.connect(localIndexPath)
+    connection.execute('CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, inode INTEGER, size INTEGER, mtime REAL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    meta = dict(connection.execute('SELECT key, value FROM meta'))
+    root = os.path.abspath(localFilesPath)
+    rootMtime = repr(os.stat(localFilesPath).st_mtime)
+    indexed = {}
+    if meta.get('root') == root and not reindex:
+        indexed = {name:(inode, size, mtime) for name, inode, size, mtime in connection.execute('SELECT name, inode, size, mtime FROM files')}
+
+    if meta.get('root') != root or meta.get('rootMtime') != rootMtime or reindex:
+        #readdir returns names and inodes without touching the files; only new or replaced files are stat-ed
+        scanned = {}
+        with os.scandir(localFilesPath) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                cached = indexed.get(entry.name)
+                if cached != None and cached[0] == entry.inode():
+                    scanned[entry.name] = cached
+                else:
+                    entryStat = entry.stat()
+                    scanned[entry.name] = (entry.inode(), entryStat.st_size, entryStat.st_mtime)
+        indexed = scanned
+
+        with connection:
+            connection.execute('DELETE FROM files')
+            connection.executemany('INSERT INTO files VALUES (?,?,?,?)', [(name,)+values for name, values in indexed.items()])
+            connection.executemany('INSERT OR REPLACE INTO meta VALUES (?,?)', [('root', root), ('rootMtime', rootMtime)])
+
+    connection.close()
+
+    return {name:(size, mtime) for name, (inode, size, mtime) in indexed.items()}
+
+
+def check_local(top10nlMapTile,localFilesPath, suffix, localIndex=None):
 
 
     mapTileFileName = build_filename(top10nlMapTile,suffix)
     mapTileFileExistsLocal=False
 
-    localMapTileFilePath = os.path.join(localFilesPath,mapTileFileName)
-
     localSize=[]
     localDate=[]
 
-    if os.path.isfile(localMapTileFilePath):
-        mapTileFileExistsLocal=True
-        localDate = datetime.datetime.fromtimestamp(os.stat(localMapTileFilePath).st_mtime)
-        localSize = os.stat(localMapTileFilePath).st_size
+    if localIndex != None:
+        if mapTileFileName in localIndex:
+            mapTileFileExistsLocal=True
+            localSize, localMtime = localIndex[mapTileFileName]
+            localDate = datetime.datetime.fromtimestamp(localMtime)
 
     else:
-        pass
+        try:
+            localStat = os.stat(os.path.join(localFilesPath,mapTileFileName))
+            mapTileFileExistsLocal=True
+            localDate = datetime.datetime.fromtimestamp(localStat.st_mtime)
+            localSize = localStat.st_size
+        except FileNotFoundError:
+            pass
 
     return mapTileFileExistsLocal, localSize, localDate
 
 
-def check_remote(top10nlMapTile, baseurl, suffix):
+def load_remote_cache(remoteCachePath):
+
+    remoteCache = {}
+
+    if os.path.isfile(remoteCachePath):
+        try:
+            with open(remoteCachePath,'r') as cachefile:
+                remoteCache = json.load(cachefile)
+        except (IOError, ValueError):
+            print('remote metadata cache {} could not be read. starting with empty cache'.format(remoteCachePath))
+
+    return remoteCache
+
+
+def save_remote_cache(remoteCache, remoteCachePath):
+
+    #write next to the target and rename, so an interrupted run never leaves a truncated cache
+    tmpCachePath = remoteCachePath+'.tmp'
+    with open(tmpCachePath,'w') as cachefile:
+        cachefile.write(json.dumps(remoteCache,indent=4))
+    os.replace(tmpCachePath,remoteCachePath)
+
+
+def probe_url(url, headers, session):
+
+    #HEAD transfers headers only. Servers refusing HEAD get a GET whose body is never read
+    response = session.pool.open('HEAD', url, headers)
+    response.release()
+    if response.status in (405, 501):
+        response = session.pool.open('GET', url, headers)
+        response.release()
+
+    return response
+
+
+def check_remote(top10nlMapTile, baseurl, suffix, session):
 
     mapTileFileName = build_filename(top10nlMapTile, suffix)
     mapTileFileUrl = build_url(baseurl, mapTileFileName)
 
     mapTileFileExistsRemote=False
-    remoteSize=[]
-    remoteDate=[]
+    remoteSize=None
+    remoteDate=None
+    remoteMeta=None
+
+    #conditional probe: an unchanged tile is answered with 304 and the cached metadata is reused
+    cachedMeta = session.remoteCache.get(mapTileFileUrl)
+    headers = {}
+    if cachedMeta != None:
+        if cachedMeta['etag'] != None:
+            headers['If-None-Match'] = cachedMeta['etag']
+        if cachedMeta['lastModified'] != None:
+            headers['If-Modified-Since'] = cachedMeta['lastModified']
+
+    #network errors are left to the caller, which retries the whole tile later
+    response = probe_url(mapTileFileUrl, headers, session)
+    if response.status == 200:
+        contentLength = response.headers['Content-Length']
+        remoteMeta = {'size':int(contentLength) if contentLength != None else None,
+                      'etag':response.headers['ETag'],
+                      'lastModified':response.headers['Last-Modified']}
+    elif response.status == 304 and cachedMeta != None:
+        remoteMeta = cachedMeta
+    elif response.status == 429 or response.status >= 500:
+        raise RetryableError('HTTP Error {}: {} for {}'.format(response.status, response.reason, mapTileFileUrl))
+    else:
+        print('HTTP Error {}: {} for {}'.format(response.status, response.reason, mapTileFileUrl))
 
-    try:
-        req = urllib.request.urlopen(mapTileFileUrl)
+    if remoteMeta != None:
         mapTileFileExistsRemote=True
-        remoteDate = datetime.datetime(*eut.parsedate(req.headers['Last-Modified'])[:6])
+        remoteSize = remoteMeta['size']
+        if remoteMeta['lastModified'] != None:
+            remoteDate = datetime.datetime(*eut.parsedate(remoteMeta['lastModified'])[:6])
+
+    return mapTileFileExistsRemote, remoteSize, remoteDate, remoteMeta
+
+
+def parse_listing(body):
+
+    #Atom feeds give sizes as link lengths; HTML autoindex pages (Apache, nginx) a date and a size after each link
+    listing = {}
+    if body.lstrip().startswith('<?xml') or '<feed' in body[:1024]:
+        for entry in ET.fromstring(body).iter(ATOM+'entry'):
+            updated = entry.findtext(ATOM+'updated')
+            #fromisoformat only accepts a trailing Z from python 3.11 on
+            lastModified = eut.format_datetime(datetime.datetime.fromisoformat(re.sub(r'Z$', '+00:00', updated.strip())).astimezone(datetime.timezone.utc), usegmt=True) if updated else None
+            for link in entry.iter(ATOM+'link'):
+                href = link.get('href')
+                if href:
+                    length = link.get('length')
+                    listing[os.path.basename(urllib.parse.urlsplit(href).path)] = {'size':int(length) if length and length.isdigit() else None, 'lastModified':lastModified}
+        return listing
+
+    for href, trailer in LISTING_ANCHOR.findall(body):
+        name = urllib.parse.unquote(os.path.basename(urllib.parse.urlsplit(href).path))
+        if name == '' or href.endswith('/'):
+            continue
+        trailer = re.sub(r'<[^>]*>', ' ', trailer)
+        lastModified = None
+        size = None
+        dateMatch = LISTING_DATE.search(trailer)
+        if dateMatch != None:
+            dateText = dateMatch.group(1).replace('T', ' ')
+            for dateFormat in ('%d-%b-%Y %H:%M:%S', '%d-%b-%Y %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+                try:
+                    #listings are taken to be in GMT, like Last-Modified
+                    lastModified = eut.format_datetime(datetime.datetime.strptime(dateText, dateFormat).replace(tzinfo=datetime.timezone.utc), usegmt=True)
+                    break
+                except ValueError:
+                    continue
+            #the size is the first field after the date; Apache rows carry a description cell behind it
+            sizeMatch = LISTING_SIZE.match(trailer, dateMatch.end())
+            #sizes rounded to K/M/G cannot be compared with the local size
+            if sizeMatch != None and sizeMatch.group(2) == '' and '.' not in sizeMatch.group(1):
+                size = int(sizeMatch.group(1))
+        listing[name] = {'size':size, 'lastModified':lastModified}
+
+    return listing
+
+
+def fetch_remote_listing(listingUrl, session):
+
+    try:
+        with session.pool.open('GET', listingUrl) as response:
+            if response.status != 200:
+                print('remote listing {} could not be fetched: HTTP Error {}: {}'.format(listingUrl, response.status, response.reason))
+                return None
+            body = response.read()
+            charset = response.headers.get_content_charset() or 'utf-8'
+    except (OSError, http.client.HTTPException) as e:
+        print('remote listing {} could not be fetched: {}'.format(listingUrl, e))
+        return None
+
+    try:
+        listing = parse_listing(body.decode(charset, errors='replace'))
+    except (ET.ParseError, ValueError) as e:
+        print('remote listing {} could not be parsed: {}'.format(listingUrl, e))
+        return None
+
+    #an error or login page, or an index rendered by javascript, lists nothing; probing every tile is safer than skipping them all
+    if len(listing) == 0:
+        print('remote listing {} lists no files, probing every tile instead'.format(listingUrl))
+        return None
+    return listing
+
+
+def listed_tiles(listing, inputList, suffix):
+
+    #without an input list every listed tile counts; tiles missing from the listing do not exist remotely
+    if inputList == None:
+        inputList = []
+        for name in sorted(listing):
+            mapTile = name[:len(name)-len(suffix)].upper() if suffix != None else name.upper()
+            if (suffix == None or name.endswith(suffix)) and build_filename(mapTile, suffix) == name:
+                inputList.append(mapTile)
+
+    #listing dates are coarse and may be in server time, so they never reach the remote cache and its conditional requests
+    listedList = [mapTile for mapTile in inputList if build_filename(mapTile, suffix) in listing]
+
+    print('remote listing: {} files. {} of {} tiles listed'.format(len(listing), len(listedList), len(inputList)))
+    return listedList
+
+
+def listed_up_to_date(mapTile, listing, suffix, session):
+
+    #the same rules as download_decider, but from the listing instead of a probe. A listing
+    #without date and size cannot vouch for a local copy, such tiles are probed
+    mapTileFileExistsLocal, localSize, localDate = check_local(mapTile, None, suffix, session.localIndex)
+    listed = listing[build_filename(mapTile, suffix)]
+    remoteDate = datetime.datetime(*eut.parsedate(listed['lastModified'])[:6]) if listed['lastModified'] != None else None
+    if not mapTileFileExistsLocal or (remoteDate == None and listed['size'] == None):
+        return False
+    return not ((remoteDate != None and remoteDate > localDate) or (listed['size'] != None and listed['size'] != localSize))
+
+
+
+
+def copy_hardlink(localSrcPath, tmpDestPath):
+    os.link(localSrcPath, tmpDestPath)
+
 
+def copy_reflink(localSrcPath, tmpDestPath):
+    if fcntl == None:
+        raise AttributeError('fcntl is not available on this platform')
+    with open(localSrcPath,'rb') as infile, open(tmpDestPath,'wb') as outfile:
+        fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+    shutil.copystat(localSrcPath, tmpDestPath)
 
-    except urllib.error.URLError as e:
-        print(e)
 
-    return mapTileFileExistsRemote, remoteSize, remoteDate
+def copy_range(localSrcPath, tmpDestPath):
+    with open(localSrcPath,'rb') as infile, open(tmpDestPath,'wb') as outfile:
+        remaining = os.fstat(infile.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(infile.fileno(), outfile.fileno(), min(remaining, COPY_CHUNK_SIZE))
+            if copied == 0:
+                raise OSError(errno.EIO, 'unexpected end of file')
+            remaining -= copied
+    shutil.copystat(localSrcPath, tmpDestPath)
 
 
+def copy_sendfile(localSrcPath, tmpDestPath):
+    with open(localSrcPath,'rb') as infile, open(tmpDestPath,'wb') as outfile:
+        offset = 0
+        size = os.fstat(infile.fileno()).st_size
+        while offset < size:
+            sent = os.sendfile(outfile.fileno(), infile.fileno(), offset, min(size-offset, COPY_CHUNK_SIZE))
+            if sent == 0:
+                raise OSError(errno.EIO, 'unexpected end of file')
+            offset += sent
+    shutil.copystat(localSrcPath, tmpDestPath)
 
 
-def copy_execute(top10nlMapTile, suffix,localFilesPath,outputDirectory):
+def copy_plain(localSrcPath, tmpDestPath):
+    shutil.copy2(localSrcPath, tmpDestPath)
+
+
+#cheapest first: data shared on disk, copied in the kernel, copied through user space. A hardlink shares the inode with
+#the local repository, so touching the output changes the repository too; auto never picks it
+COPY_STRATEGIES = [('reflink', copy_reflink), ('copyrange', copy_range), ('sendfile', copy_sendfile), ('copy', copy_plain), ('hardlink', copy_hardlink)]
+AUTO_COPY_STRATEGIES = ['reflink', 'copyrange', 'sendfile', 'copy']
+
+
+def copy_execute(top10nlMapTile, suffix,localFilesPath,outputDirectory, session):
 
     mapTileFileName = build_filename(top10nlMapTile, suffix)
     localSrcPath = os.path.join(localFilesPath,mapTileFileName)
-    #localDestPath = ps.path.join(outputDirectory,mapTileFileName)
+    localDestPath = os.path.join(outputDirectory,mapTileFileName)
+    tmpDestPath = localDestPath+'.part'
     copySuccess = False
+    strategyUsed = None
+
+    if session.copyStrategy == 'auto':
+        strategies = [strategy for strategy in COPY_STRATEGIES if strategy[0] in AUTO_COPY_STRATEGIES and strategy[0] not in session.unsupportedCopyStrategies]
+    else:
+        strategies = [strategy for strategy in COPY_STRATEGIES if strategy[0] == session.copyStrategy]
+
+    for strategyName, strategyFunction in strategies:
+        try:
+            if os.path.lexists(tmpDestPath):
+                os.remove(tmpDestPath)
+            strategyFunction(localSrcPath, tmpDestPath)
+            os.replace(tmpDestPath, localDestPath)
+            copySuccess = True
+            strategyUsed = strategyName
+            break
+        except (OSError, AttributeError) as e:
+            if os.path.lexists(tmpDestPath):
+                os.remove(tmpDestPath)
+            #a strategy this filesystem (or platform) cannot do is not tried again during this run
+            if isinstance(e, AttributeError) or e.errno in UNSUPPORTED_COPY_ERRNOS:
+                session.unsupportedCopyStrategies.add(strategyName)
+                continue
+            print('failed to copy file {} to {}: {}'.format(localSrcPath,outputDirectory,e))
+            break
+    else:
+        print('failed to copy file {} to {}: no usable copy strategy'.format(localSrcPath,outputDirectory))
+
+    return copySuccess, strategyUsed
+
+
+
+def read_las_header(headerBytes):
+
+    #public header block of LAS 1.0-1.4; LAZ keeps it uncompressed and sets the top bits of the point format
+    if len(headerBytes) < 227 or headerBytes[:4] != b'LASF':
+        raise ValueError('no LAS signature')
+    versionMajor, versionMinor = headerBytes[24], headerBytes[25]
+    if versionMajor != 1 or versionMinor > 4:
+        raise ValueError('unsupported LAS version {}.{}'.format(versionMajor, versionMinor))
+    pointFormat = headerBytes[104]
+    pointCount = struct.unpack_from('<I', headerBytes, 107)[0]
+    if versionMinor >= 4 and len(headerBytes) >= 255:
+        pointCount = max(pointCount, struct.unpack_from('<Q', headerBytes, 247)[0])
+    maxX, minX, maxY, minY, maxZ, minZ = struct.unpack_from('<6d', headerBytes, 179)
+    if pointCount == 0:
+        raise ValueError('no points')
+    if not (minX <= maxX and minY <= maxY and minZ <= maxZ):
+        raise ValueError('invalid bounding box')
+
+    return {'version':'{}.{}'.format(versionMajor, versionMinor),
+            'pointFormat':pointFormat & 0x3f,
+            'compressed':bool(pointFormat & 0x80),
+            'pointCount':pointCount,
+            'bbox':[minX, minY, minZ, maxX, maxY, maxZ]}
+
+
+def finish_extract(partPath, lasPath, headerBytes):
+
+    try:
+        header = read_las_header(headerBytes)
+    except ValueError as e:
+        os.remove(partPath)
+        return {'file':os.path.basename(lasPath), 'success':False, 'error':'invalid LAS header: {}'.format(e)}
+    os.replace(partPath, lasPath)
+    return {'file':os.path.basename(lasPath), 'success':True, 'laz':header}
+
 
+def extract_file(zipPath, outputDir):
 
+    #unzips a finished download; used when the tile was not streamed (resumed, segmented, copied)
+    t0 = time.perf_counter()
+    partPath = None
+    try:
+        with zipfile.ZipFile(zipPath) as zipFile:
+            member = zipFile.infolist()[0]
+            lasPath = os.path.join(outputDir, os.path.basename(member.filename))
+            if os.path.isfile(lasPath) and os.path.getsize(lasPath) == member.file_size and os.path.getmtime(lasPath) >= os.path.getmtime(zipPath):
+                return None, 0., 0
+            partPath = lasPath+'.part'
+            headerBytes = b''
+            #ZipExtFile checks the CRC when the member has been read to the end
+            with zipFile.open(member) as infile, open(partPath,'wb') as outfile:
+                for chunk in iter(lambda: infile.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    outfile.write(chunk)
+                    if len(headerBytes) < LAS_HEADER_SIZE:
+                        headerBytes += chunk[:LAS_HEADER_SIZE-len(headerBytes)]
+    except (OSError, EOFError, IndexError, zlib.error, zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+        print('failed to extract {}: {}'.format(zipPath, e))
+        if partPath != None and os.path.isfile(partPath):
+            os.remove(partPath)
+        return {'file':os.path.basename(lasPath) if partPath != None else None, 'success':False, 'error':'{}: {}'.format(type(e).__name__, e)}, time.perf_counter()-t0, 0
+
+    extractInfo = finish_extract(partPath, lasPath, headerBytes)
+    return extractInfo, time.perf_counter()-t0, member.file_size if extractInfo['success'] else 0
+
+
+def extract_stream(extractQueue, outputDir):
+
+    #inflates the first zip member while the download worker is still receiving it. The queue carries the
+    #received chunks and finally the path of the completed zip, or None if the download failed
+    t0 = time.perf_counter()
+    buffered = b''
+    member = None
+    partPath = None
+    outfile = None
+    streaming = True
+    crc = 0
+    size = 0
+    headerBytes = b''
+
+    while True:
+        item = extractQueue.get()
+        if not isinstance(item, bytes):
+            zipPath = item
+            break
+        if not streaming:
+            #keep draining, so the download worker never blocks on a dead consumer
+            continue
+        try:
+            if member == None:
+                buffered += item
+                if len(buffered) < ZIP_LOCAL_HEADER.size:
+                    continue
+                signature, version, flags, method, modTime, modDate, headerCrc, compressedSize, fileSize, nameLength, extraLength = ZIP_LOCAL_HEADER.unpack_from(buffered)
+                if len(buffered) < ZIP_LOCAL_HEADER.size+nameLength+extraLength:
+                    continue
+                #encrypted members and stored members of unknown length cannot be streamed
+                if signature != b'PK\x03\x04' or flags & 0x1 or method not in (0, 8) or (method == 0 and flags & 0x8):
+                    streaming = False
+                    continue
+                if method == 0 and compressedSize == 0xffffffff:
+                    streaming = False
+                    continue
+                member = buffered[ZIP_LOCAL_HEADER.size:ZIP_LOCAL_HEADER.size+nameLength].decode('cp437' if not flags & 0x800 else 'utf-8')
+                item = buffered[ZIP_LOCAL_HEADER.size+nameLength+extraLength:]
+                buffered = None
+                decompressor = zlib.decompressobj(-15) if method == 8 else None
+                remaining = compressedSize
+                lasPath = os.path.join(outputDir, os.path.basename(member))
+                partPath = lasPath+'.part'
+                outfile = open(partPath,'wb')
+
+            if decompressor != None:
+                if decompressor.eof:
+                    continue
+                data = decompressor.decompress(item)
+            else:
+                data = item[:remaining]
+                remaining -= len(data)
+            outfile.write(data)
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            if len(headerBytes) < LAS_HEADER_SIZE:
+                headerBytes += data[:LAS_HEADER_SIZE-len(headerBytes)]
+        except (OSError, zlib.error, UnicodeDecodeError) as e:
+            print('streaming extraction failed: {}. extracting after the download'.format(e))
+            streaming = False
+
+    if outfile != None:
+        outfile.close()
+    if zipPath == None or not streaming or member == None or (decompressor != None and not decompressor.eof):
+        if partPath != None and os.path.isfile(partPath):
+            os.remove(partPath)
+        if zipPath == None:
+            return None, 0., 0
+        return extract_file(zipPath, outputDir)
+
+    #the central directory at the end of the completed zip has the sizes and CRC a streamed member is checked against
     try:
-        shutil.copy2(localSrcPath,outputDirectory)
-        copySuccess = True
-    except:
-        print('failed to copy file {} to {}'.format(localSrcPath,outputDirectory))
+        with zipfile.ZipFile(zipPath) as zipFile:
+            expected = zipFile.infolist()[0]
+    except (OSError, IndexError, zipfile.BadZipFile) as e:
+        os.remove(partPath)
+        return {'file':None, 'success':False, 'error':'{}: {}'.format(type(e).__name__, e)}, time.perf_counter()-t0, 0
+    if expected.filename != member or expected.CRC != crc or expected.file_size != size:
+        os.remove(partPath)
+        return {'file':os.path.basename(member), 'success':False, 'error':'CRC or size mismatch of the extracted member'}, time.perf_counter()-t0, 0
 
-    return copySuccess
+    extractInfo = finish_extract(partPath, lasPath, headerBytes)
+    return extractInfo, time.perf_counter()-t0, size if extractInfo['success'] else 0
 
 
+def extract_in_slot(extractSlots, extractFunction, *args):
 
+    #the slot was taken when the task was submitted, so no extract task ever waits for a worker
+    try:
+        return extractFunction(*args)
+    finally:
+        extractSlots.release()
+
+
+def feed_extractor(extractFeed, item):
+
+    #hands a chunk to the extract worker; gives up on streaming if that worker is gone (e.g. cancelled)
+    extractQueue, extractFuture = extractFeed
+    while True:
+        try:
+            extractQueue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            if extractFuture.done():
+                return False
 
-def download_decider(top10nlMapTile, localFilesPath, baseurl, suffix):
 
-    mapTileFileExistsLocal, localSize, localDate = check_local(top10nlMapTile,localFilesPath, suffix)
 
-    mapTileFileExistsRemote, remoteSize, remoteDate = check_remote(top10nlMapTile, baseurl, suffix)
+def download_decider(top10nlMapTile, localFilesPath, baseurl, suffix, session):
+
+    mapTileFileExistsLocal, localSize, localDate = check_local(top10nlMapTile,localFilesPath, suffix, session.localIndex)
+
+    mapTileFileExistsRemote, remoteSize, remoteDate, remoteMeta = check_remote(top10nlMapTile, baseurl, suffix, session)
 
     download=False
 
@@ -127,38 +853,311 @@ def download_decider(top10nlMapTile, localFilesPath, baseurl, suffix):
         if mapTileFileExistsLocal == False:
             download = True
         else:
-            if ((remoteDate > localDate) or (remoteSize != localSize)):
+            #attributes the server did not report cannot force a download
+            if ((remoteDate != None and remoteDate > localDate) or (remoteSize != None and remoteSize != localSize)):
                 download = True
     else:
         if mapTileFileExistsLocal == True:
             print('Unclear origin of data for {}'.format(top10nlMapTile))
 
 
-    return download, mapTileFileExistsLocal
+    return download, mapTileFileExistsLocal, remoteMeta
+
+
+
+def parse_digest(headers, fullBody):
+
+    #Digest (RFC 3230) describes the whole file; Content-MD5 only the body of this response
+    digestAlgorithms = {'sha-512':'sha512', 'sha-256':'sha256', 'sha':'sha1', 'md5':'md5'}
+    offered = {}
+    if headers['Digest'] != None:
+        for item in headers['Digest'].split(','):
+            algorithm, sep, value = item.strip().partition('=')
+            if algorithm.lower() in digestAlgorithms:
+                offered[digestAlgorithms[algorithm.lower()]] = value
+    if fullBody and headers['Content-MD5'] != None:
+        offered['md5'] = headers['Content-MD5'].strip()
+
+    for algorithm in ('sha512', 'sha256', 'sha1', 'md5'):
+        if algorithm in offered:
+            return [algorithm, offered[algorithm]]
+    return None
+
+
+def file_digest(filePath, algorithm):
 
+    hasher = hashlib.new(algorithm)
+    with open(filePath,'rb') as infile:
+        for chunk in iter(lambda: infile.read(DOWNLOAD_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return base64.b64encode(hasher.digest()).decode('ascii')
 
 
-def download_execute(top10nlMapTile, baseurrl, suffix, outputDir):
+def load_part_state(partStatePath):
 
+    partState = None
+    if os.path.isfile(partStatePath):
+        try:
+            with open(partStatePath,'r') as statefile:
+                partState = json.load(statefile)
+        except (IOError, ValueError):
+            pass
+    return partState
+
+
+def save_part_state(partState, partStatePath):
+
+    with open(partStatePath,'w') as statefile:
+        statefile.write(json.dumps(partState,indent=4))
+
+
+def fetch_segment(mapTileFileUrl, partFileDescriptor, segment, validator, session, stateLock, saveState, transfer):
+
+    start, end, written = segment
+    if start+written >= end:
+        return True
+
+    headers = {'Range':'bytes={}-{}'.format(start+written, end-1), 'If-Range':validator}
+    t0 = time.perf_counter()
+    with session.pool.open('GET', mapTileFileUrl, headers) as response:
+        with stateLock:
+            transfer.setdefault('firstByte', time.perf_counter()-t0)
+        if response.status == 200 or (response.status == 206 and not (response.headers['Content-Range'] or '').startswith('bytes {}-'.format(start+written))):
+            #the remote file changed: If-Range answered with the full body, or with a range we did not ask for
+            return None
+        if response.status == 429 or response.status >= 500:
+            raise RetryableError('HTTP Error {}: {} for {}'.format(response.status, response.reason, mapTileFileUrl))
+        if response.status != 206:
+            print('failure while downloading segment of {}: HTTP Error {}: {}'.format(mapTileFileUrl, response.status, response.reason))
+            return False
+        unsavedBytes = 0
+        for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+            chunk = chunk[:end-start-written]
+            os.pwrite(partFileDescriptor, chunk, start+written)
+            written += len(chunk)
+            unsavedBytes += len(chunk)
+            segment[2] = written
+            with stateLock:
+                transfer['bytes'] += len(chunk)
+            if unsavedBytes >= SEGMENT_STATE_INTERVAL:
+                with stateLock:
+                    saveState()
+                unsavedBytes = 0
+
+    return start+written >= end
+
+
+def download_segmented(mapTileFileName, mapTileFileUrl, outputFilePath, session, remoteMeta, partState, transfer):
+
+    partFilePath = outputFilePath+'.part'
+    partStatePath = partFilePath+'.js'
+    totalSize = remoteMeta['size']
+
+    if partState == None or partState.get('segments') == None or partState['size'] != totalSize or not os.path.isfile(partFilePath):
+        #a one byte range request tells whether the server supports ranges and pins the remote version
+        t0 = time.perf_counter()
+        with session.pool.open('GET', mapTileFileUrl, {'Range':'bytes=0-0'}) as response:
+            transfer['firstByte'] = time.perf_counter()-t0
+            contentRange = response.headers['Content-Range']
+            if response.status != 206 or contentRange == None or contentRange.rpartition('/')[2] != str(totalSize):
+                print('server does not support ranges for {}. falling back to a single stream'.format(mapTileFileName))
+                return None
+            segmentSize = -(-totalSize//session.segments)
+            partState = {'url':mapTileFileUrl,
+                         'etag':response.headers['ETag'],
+                         'lastModified':response.headers['Last-Modified'],
+                         'size':totalSize,
+                         'digest':parse_digest(response.headers, False),
+                         'segments':[[start, min(start+segmentSize, totalSize), 0] for start in range(0, totalSize, segmentSize)]}
+        if partState['etag'] == None and partState['lastModified'] == None:
+            print('no validator for {}. falling back to a single stream'.format(mapTileFileName))
+            return None
+        with open(partFilePath,'wb') as partfile:
+            partfile.truncate(totalSize)
+        save_part_state(partState, partStatePath)
+    else:
+        print('resuming segmented download of {}'.format(mapTileFileName))
+
+    validator = partState['etag'] if partState['etag'] != None else partState['lastModified']
+    stateLock = threading.Lock()
+    saveState = lambda: save_part_state(partState, partStatePath)
+
+    partFileDescriptor = os.open(partFilePath, os.O_WRONLY)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(partState['segments'])) as segmentExecutor:
+            futures = [segmentExecutor.submit(fetch_segment, mapTileFileUrl, partFileDescriptor, segment, validator, session, stateLock, saveState, transfer) for segment in partState['segments']]
+            segmentsComplete = [future.result() for future in futures]
+    except (OSError, http.client.HTTPException, RetryableError) as e:
+        print('failure while downloading {}: {}. partial data kept for resume'.format(mapTileFileName, e))
+        segmentsComplete = [False]
+    finally:
+        os.close(partFileDescriptor)
+        with stateLock:
+            saveState()
+
+    if None in segmentsComplete:
+        print('remote file {} changed during segmented download. discarding partial data'.format(mapTileFileName))
+        os.remove(partFilePath)
+        os.remove(partStatePath)
+        return False
+
+    if not all(segmentsComplete):
+        print('download of {} incomplete: {} of {} bytes'.format(mapTileFileName, sum(segment[2] for segment in partState['segments']), totalSize))
+        return False
+
+    if partState['digest'] != None:
+        algorithm, expectedDigest = partState['digest']
+        if file_digest(partFilePath, algorithm) != expectedDigest:
+            print('checksum mismatch for {} ({}). discarding download'.format(mapTileFileName, algorithm))
+            os.remove(partFilePath)
+            os.remove(partStatePath)
+            return False
+
+    os.replace(partFilePath, outputFilePath)
+    os.remove(partStatePath)
+    return True
+
+
+def download_execute(top10nlMapTile, baseurl, suffix, outputDir, session, remoteMeta=None, transfer=None):
+
+    #transfer collects the time to the first response and the bytes received, also of failed attempts
+    if transfer == None:
+        transfer = {}
+    transfer['bytes'] = 0
     mapTileFileName = build_filename(top10nlMapTile,suffix)
     mapTileFileUrl = build_url(baseurl, mapTileFileName)
 
     outputFilePath = os.path.join(outputDir,mapTileFileName)
+    #bytes are streamed into a .part file, its .part.js remembers which remote version they belong to
+    partFilePath = outputFilePath+'.part'
+    partStatePath = partFilePath+'.js'
     downloadSuccess = False
 
+    partState = load_part_state(partStatePath)
+
+    #segments are written with os.pwrite, which windows lacks; there every tile takes a single stream
+    if session.segments > 1 and hasattr(os, 'pwrite') and remoteMeta != None and remoteMeta['size'] != None and remoteMeta['size'] >= session.segmentThreshold:
+        segmentedSuccess = download_segmented(mapTileFileName, mapTileFileUrl, outputFilePath, session, remoteMeta, partState, transfer)
+        if segmentedSuccess != None:
+            return segmentedSuccess
+        partState = None
+
+    if partState != None and partState.get('segments') != None:
+        #left behind by a segmented download; the size of its preallocated part says nothing about the bytes received
+        partState = None
+
+    resumeFrom = 0
+    headers = {}
+    if partState != None and os.path.isfile(partFilePath):
+        resumeFrom = os.path.getsize(partFilePath)
+        validator = partState['etag'] if partState['etag'] != None else partState['lastModified']
+        if resumeFrom > 0 and validator != None:
+            headers['Range'] = 'bytes={}-'.format(resumeFrom)
+            #If-Range: a changed remote file is sent in full instead of being appended
+            headers['If-Range'] = validator
+        else:
+            resumeFrom = 0
+
     try:
-        urllib.request.urlretrieve(mapTileFileUrl,outputFilePath)
-        downloadSuccess = True
-    except urllib.error.URLError:
-        print('failure while downloading')
+        t0 = time.perf_counter()
+        with session.pool.open('GET', mapTileFileUrl, headers) as response:
+            transfer['firstByte'] = time.perf_counter()-t0
+            contentRange = response.headers['Content-Range']
+            if response.status == 206 and contentRange != None and contentRange.startswith('bytes {}-'.format(resumeFrom)):
+                totalSize = contentRange.rpartition('/')[2]
+                writeMode = 'ab'
+                print('resuming download of {} at byte {}'.format(mapTileFileName, resumeFrom))
+            elif response.status == 200:
+                totalSize = response.headers['Content-Length']
+                resumeFrom = 0
+                writeMode = 'wb'
+            elif response.status == 416 and resumeFrom > 0:
+                #nothing left to fetch; the size check below decides whether the part is complete
+                totalSize = contentRange.rpartition('/')[2] if contentRange != None else None
+                writeMode = None
+            else:
+                print('failure while downloading: HTTP Error {}: {}'.format(response.status, response.reason))
+                if response.status == 206:
+                    #a range we did not ask for; start over on the next attempt
+                    os.remove(partFilePath)
+                return downloadSuccess
+
+            totalSize = int(totalSize) if totalSize not in (None, '*') else None
+            if totalSize == None and writeMode != 'wb':
+                totalSize = partState['size']
+            if totalSize == None and remoteMeta != None:
+                totalSize = remoteMeta['size']
+
+            if writeMode == 'wb':
+                partState = {'url':mapTileFileUrl,
+                             'etag':response.headers['ETag'],
+                             'lastModified':response.headers['Last-Modified'],
+                             'size':totalSize,
+                             'digest':parse_digest(response.headers, True)}
+                save_part_state(partState, partStatePath)
+            elif partState['digest'] == None:
+                partState['digest'] = parse_digest(response.headers, False)
+
+            if writeMode != None:
+                hasher = hashlib.new(partState['digest'][0]) if (partState['digest'] != None and resumeFrom == 0) else None
+                #a body received from its first byte can be unzipped on the fly by an extract worker
+                extractFeed = None
+                #only with an idle extract worker; waiting for one would stall this download once the queue is full
+                if writeMode == 'wb' and session.extractExecutor != None and session.extractSlots.acquire(blocking=False):
+                    extractQueue = queue.Queue(maxsize=EXTRACT_QUEUE_CHUNKS)
+                    extractFeed = (extractQueue, session.extractExecutor.submit(extract_in_slot, session.extractSlots, extract_stream, extractQueue, outputDir))
+                    transfer['extract'] = extractFeed
+                with open(partFilePath, writeMode) as outfile:
+                    for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        outfile.write(chunk)
+                        transfer['bytes'] += len(chunk)
+                        if hasher != None:
+                            hasher.update(chunk)
+                        if extractFeed != None and not feed_extractor(extractFeed, chunk):
+                            extractFeed = None
+
+    except (OSError, http.client.HTTPException) as e:
+        print('failure while downloading {}: {}. partial data kept for resume'.format(mapTileFileName, e))
+        return downloadSuccess
+
+    partSize = os.path.getsize(partFilePath) if os.path.isfile(partFilePath) else 0
+    if totalSize != None and partSize != totalSize:
+        print('download of {} incomplete: {} of {} bytes'.format(mapTileFileName, partSize, totalSize))
+        if partSize > totalSize:
+            os.remove(partFilePath)
+            os.remove(partStatePath)
+        return downloadSuccess
+
+    if partState['digest'] != None:
+        algorithm, expectedDigest = partState['digest']
+        if writeMode == 'wb':
+            actualDigest = base64.b64encode(hasher.digest()).decode('ascii')
+        else:
+            actualDigest = file_digest(partFilePath, algorithm)
+        if actualDigest != expectedDigest:
+            print('checksum mismatch for {} ({}). discarding download'.format(mapTileFileName, algorithm))
+            os.remove(partFilePath)
+            os.remove(partStatePath)
+            return downloadSuccess
+
+    os.replace(partFilePath, outputFilePath)
+    os.remove(partStatePath)
+    downloadSuccess = True
 
     return downloadSuccess
 
 
 
-def maptile_downloader(top10nlMapTile,localFilesPath,outputDir,baseurl, suffix, copylocal):
+def maptile_downloader(top10nlMapTile,localFilesPath,outputDir,baseurl, suffix, copylocal, session):
+
+    #seconds spent per stage and bytes moved, kept with the tile in the manifest
+    timings = {}
+    transferred = {}
+    extractFuture = None
 
-    executeDownload, localExists = download_decider(top10nlMapTile,localFilesPath, baseurl, suffix)
+    t0 = time.perf_counter()
+    executeDownload, localExists, remoteMeta = download_decider(top10nlMapTile,localFilesPath, baseurl, suffix, session)
+    timings['probe'] = time.perf_counter()-t0
 
     downloadSuccess = False
     executeCopy = False
@@ -166,7 +1165,21 @@ def maptile_downloader(top10nlMapTile,localFilesPath,outputDir,baseurl, suffix,
 
     if executeDownload == True:
 
-        downloadSuccess = download_execute(top10nlMapTile,baseurl, suffix, outputDir)
+        transfer = {}
+        t0 = time.perf_counter()
+        try:
+            downloadSuccess = download_execute(top10nlMapTile,baseurl, suffix, outputDir, session, remoteMeta, transfer)
+        finally:
+            #tells a streaming extract worker where the complete zip is, or that there is none
+            if 'extract' in transfer:
+                feed_extractor(transfer['extract'], os.path.join(outputDir, build_filename(top10nlMapTile, suffix)) if downloadSuccess else None)
+        timings['download'] = time.perf_counter()-t0
+        if downloadSuccess and 'extract' in transfer:
+            #joined by run(); not part of the manifest
+            extractFuture = transfer['extract'][1]
+        if transfer.get('firstByte') != None:
+            timings['firstByte'] = transfer['firstByte']
+        transferred['download'] = transfer['bytes']
 
     else:
         if localExists == True:
@@ -180,13 +1193,16 @@ def maptile_downloader(top10nlMapTile,localFilesPath,outputDir,baseurl, suffix,
                     print('in place no copy necessary')
                     copySuccess = True
                 else:
-                    copySuccess = copy_execute(top10nlMapTile,suffix, localFilesPath,outputDir)
+                    #left to the copy workers, so this network worker can move on to the next tile
+                    copySuccess = None
         else:
             print('neither local nor remote tile {} found'.format(top10nlMapTile))
 
 
-    time.sleep(1)
-    return executeDownload, downloadSuccess, executeCopy, copySuccess
+    tileInfo = {'remote':remoteMeta, 'timings':timings, 'bytes':transferred}
+    if extractFuture != None:
+        tileInfo['extractFuture'] = extractFuture
+    return executeDownload, downloadSuccess, executeCopy, copySuccess, tileInfo
 
 
 def read_input(infile):
@@ -203,44 +1219,203 @@ def read_input(infile):
     return tileList
 
 
-def run(localFilesPath,outputDir, baseurl, suffix, numberProcs tag, inputList=[],copylocal=False):
+def run(localFilesPath,outputDir, baseurl, suffix, numberProcs, tag, inputList=[],copylocal=False,remoteCachePath=None,maxPerHost=None,segments=1,segmentThreshold=512,localIndexPath=None,reindex=False,maxRequestRate=None,maxBandwidth=None,maxRetries=3,shard=None,shardDir=None,resume=False,copyStrategy='auto',copyWorkers=4,extract=False,extractWorkers=2,discover=False,listingUrl=None):
     #check input
     if not os.path.isdir(localFilesPath):
         raise Exception('Error: local file path is not a valid directory!')
     elif os.path.isfile(outputDir):
         raise Exception('Error: file with same name as output directory exists! Please delete it.')
 
-    #Create queues for distributed multiprocessing
-    tasksQueue = multiprocessing.Queue()
-    resultsQueue = multiprocessing.Queue()
-
-    #add tiles to task queues
+    if remoteCachePath == None:
+        remoteCachePath = os.path.join(outputDir,'remoteMetadataCache.js')
+    remoteCache = load_remote_cache(remoteCachePath)
+
+    if maxPerHost != None and segments > 1 and maxPerHost < segments:
+        print('warning: --perhost {} allows fewer connections than --segments {}; segments will wait for each other'.format(maxPerHost, segments))
+    if maxPerHost == None:
+        #segments of a tile need connections of their own next to the other workers
+        maxPerHost = numberProcs*segments if segments > 1 else numberProcs
+    if localIndexPath == None:
+        localIndexPath = os.path.join(outputDir,'localIndex.sqlite')
+    localIndex = update_local_index(localFilesPath, localIndexPath, reindex)
+    print('{} files indexed in local repository'.format(len(localIndex)))
+
+    limiter = RateLimiter(maxRequestRate, maxBandwidth*1024*1024 if maxBandwidth != None else None)
+    session = DownloadSession(ConnectionPool(maxPerHost, limiter=limiter), remoteCache, localIndex, segments, int(segmentThreshold*1024*1024))
+    session.copyStrategy = copyStrategy
+
+    #one request for the whole listing instead of a probe per tile; without a listing every tile is probed as usual
+    listing = None
+    if discover:
+        listing = fetch_remote_listing(listingUrl if listingUrl != None else baseurl, session)
+        if listing != None:
+            inputList = listed_tiles(listing, inputList, suffix)
+        elif inputList == None:
+            inputList = download_list_top10nl()
+
+    manifestTag = str(tag)
+    claimDir = None
+    nodeId = None
+    if shard != None:
+        shardIndex, shardCount = shard
+        #only inputs every node shares may shape the split: sizes from the remote listing, never from the per-node cache
+        shardSizes = {mapTile:listing[build_filename(mapTile, suffix)]['size'] for mapTile in inputList} if listing != None else {}
+        subMapLists = assign_shards(inputList, shardCount, shardSizes)
+        manifestTag = '{}-shard{}of{}'.format(tag, shardIndex, shardCount)
+        inputList = subMapLists[shardIndex]
+        print('shard {} of {}: {} tiles assigned'.format(shardIndex, shardCount, len(inputList)))
+        if shardDir != None:
+            #own tiles first, then steal from the tail of the other shards while their owners work from the head
+            claimDir = os.path.join(shardDir, 'claims-'+str(tag))
+            os.makedirs(claimDir, exist_ok=True)
+            nodeId = '{}/{}'.format(shardIndex, shardCount)
+            for otherList in subMapLists[shardIndex+1:]+subMapLists[:shardIndex]:
+                inputList = inputList+otherList[::-1]
+
+    #only after sharding, so every node splits the same list whatever its local state; tiles to copy are kept
+    if listing != None and not (copylocal and os.path.abspath(localFilesPath) != os.path.abspath(outputDir)):
+        todoList = [mapTile for mapTile in inputList if not listed_up_to_date(mapTile, listing, suffix, session)]
+        print('{} tiles up-to-date according to the remote listing, {} left to process'.format(len(inputList)-len(todoList), len(todoList)))
+        inputList = todoList
+
+    #every final tile result is appended to the journal as soon as it arrives; a resumed run skips finished tiles
+    journalPath = os.path.join(outputDir, 'downloadList-'+manifestTag+'-journal.jsonl')
+    if resume:
+        journal = read_journal(journalPath)
+        inputList = [mapTile for mapTile in inputList if not (mapTile in journal and not tile_failed(journal[mapTile]))]
+        print('resuming run {}: {} tiles already done, {} left'.format(tag, len(journal), len(inputList)))
+
+    session.claimDir = claimDir
+    session.nodeId = nodeId
+
+    #the work is network bound: numberProcs threads share one pool of keep-alive connections
+    journalFile = open(journalPath, 'a' if resume else 'w')
     lengthInputList=len(inputList)
-    for i in range(lengthInputList):
-        tasksQueue.put(inputList[i])
-    for i in range(numberProcs): #add as many None jobs as processes toensure terminantion (queue id FIFO)
-        tasksQueue.put(None)
-
-    processes = []
-    #start number of user processes corresponding to declared numberProcs
-    for i in range(numberProcs):
-        processes.append(multiprocessing.Process(target=runTileDownloadProc,args=(i,tasksQueue,resultsQueue,localFilesPath,outputDir, baseurl, suffix,copylocal)))
-        processes[-1].start()
-
-    downloadList =[]
-    for i in range(lengthInputList):
-        results = resultsQueue.get()
-        downloadList.append(results)
-        print('Completed {0} of {1} {2} %'.format(i+1, lengthInputList,100.*(float(i+1)/lengthInputList)))
-
-    for i in range(numberProcs):
-        processes[i].join()
-
-    downloadDict = {downloadListElement[0]:downloadListElement[1:] for downloadListElement in downloadList}
+    #failed tiles wait in a heap ordered by the time their next attempt is due
+    retryQueue = []
+    handled = 0
+    #live throughput of this run, the per tile numbers end up in the manifest and the metrics files
+    runStart = time.monotonic()
+    runBytes = {'download':0, 'copy':0, 'extract':0}
+    outcomes = {'downloaded':0, 'copied':0, 'skipped':0, 'failed':0}
+    stageTimes = {'probe':[], 'firstByte':[], 'download':[], 'copy':[], 'extract':[]}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=numberProcs, initializer=init_tile_worker, initargs=(itertools.count(),))
+    copyExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=copyWorkers)
+    #unzipping is CPU and disk bound, so it gets its own bounded pool and overlaps with the next downloads
+    extractExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=extractWorkers) if extract else None
+    session.extractExecutor = extractExecutor
+    session.extractSlots = threading.BoundedSemaphore(extractWorkers) if extract else None
+    #tiles unzipped from disk wait here for a free extract worker; a slot taken by a stream is never queued behind them
+    extractBacklog = collections.deque()
+    try:
+        #pending futures map to (mapTile, attempt, results waiting for their copy or extraction, stage)
+        pending = {executor.submit(runTileDownloadTask, mapTile, localFilesPath, outputDir, baseurl, suffix, copylocal, session):(mapTile, 0, None, None) for mapTile in inputList}
+
+        while pending or retryQueue or extractBacklog:
+            while retryQueue and retryQueue[0][0] <= time.monotonic():
+                retryTime, mapTile, attempt = heapq.heappop(retryQueue)
+                pending[executor.submit(runTileDownloadTask, mapTile, localFilesPath, outputDir, baseurl, suffix, copylocal, session)] = (mapTile, attempt, None, None)
+            while extractBacklog and session.extractSlots.acquire(blocking=False):
+                mapTile, attempt, results, zipPath = extractBacklog.popleft()
+                pending[extractExecutor.submit(extract_in_slot, session.extractSlots, extract_file, zipPath, outputDir)] = (mapTile, attempt, results, 'extract')
+
+            timeout = max(0., retryQueue[0][0]-time.monotonic()) if retryQueue else None
+            if extractBacklog:
+                #a slot may be freed by a stream whose download failed and which is therefore not pending here
+                timeout = min(timeout, EXTRACT_BACKLOG_POLL) if timeout != None else EXTRACT_BACKLOG_POLL
+            if not pending:
+                #wait() returns at once for an empty set; sleep until the next retry or backlog check instead of spinning
+                time.sleep(timeout)
+                continue
+            done, notDone = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                mapTile, attempt, waitingResults, stage = pending.pop(future)
+                if stage == 'copy':
+                    results = waitingResults
+                    try:
+                        results[5], results[-1]['copyStrategy'], results[-1]['timings']['copy'], results[-1]['bytes']['copy'] = future.result()
+                    except Exception as e:
+                        #one broken tile must not take the whole run down
+                        print('copying mapTile {} failed'.format(mapTile))
+                        print(traceback.format_exc())
+                        results[5] = False
+                        results[-1]['error'] = '{}: {}'.format(type(e).__name__, e)
+                    runBytes['copy'] += results[-1]['bytes'].get('copy', 0)
+                elif stage == 'extract':
+                    results = waitingResults
+                    try:
+                        extractInfo, extractTime, extractedBytes = future.result()
+                    except Exception as e:
+                        print('extracting mapTile {} failed'.format(mapTile))
+                        print(traceback.format_exc())
+                        extractInfo, extractTime, extractedBytes = {'file':None, 'success':False, 'error':'{}: {}'.format(type(e).__name__, e)}, 0., 0
+                    if extractInfo != None:
+                        results[-1]['extract'], results[-1]['timings']['extract'], results[-1]['bytes']['extract'] = extractInfo, extractTime, extractedBytes
+                        runBytes['extract'] += extractedBytes
+                else:
+                    results = future.result()
+                    if results == None:
+                        #claimed by another node
+                        handled += 1
+                        continue
+                    results[-1]['attempts'] = attempt+1
+                    runBytes['download'] += results[-1].get('bytes', {}).get('download', 0)
+                    if results[4] == True and results[5] == None:
+                        pending[copyExecutor.submit(runTileCopyTask, mapTile, suffix, localFilesPath, outputDir, session)] = (mapTile, attempt, results, 'copy')
+                        continue
+                    if tile_failed(results[1:]) and attempt < maxRetries:
+                        delay = backoff_delay(attempt, base=TILE_BACKOFF_BASE)
+                        print('retrying mapTile {} in {:.1f} seconds (attempt {} of {})'.format(mapTile, delay, attempt+2, maxRetries+1))
+                        heapq.heappush(retryQueue, (time.monotonic()+delay, mapTile, attempt+1))
+                        continue
+
+                if stage != 'extract' and extractExecutor != None and not tile_failed(results[1:]):
+                    #downloads that were streamed are already being unzipped; other downloaded or copied tiles are unzipped from disk. Up-to-date tiles are left alone
+                    extractFuture = results[-1].pop('extractFuture', None)
+                    zipPath = os.path.join(outputDir, build_filename(mapTile, suffix))
+                    if extractFuture != None:
+                        pending[extractFuture] = (mapTile, attempt, results, 'extract')
+                        continue
+                    if ((results[2] and results[3]) or (results[4] and results[5])) and os.path.isfile(zipPath):
+                        extractBacklog.append((mapTile, attempt, results, zipPath))
+                        continue
+
+                journalFile.write(json.dumps(results)+'\n')
+                journalFile.flush()
+                handled += 1
+                #keep the metadata of the latest probe; tiles that vanished remotely are dropped
+                mapTileFileName, mapTileFileUrl = build_file_identifiers(results[0], baseurl, suffix)
+                if 'remote' in results[-1]:
+                    if results[-1]['remote'] != None:
+                        remoteCache[mapTileFileUrl] = results[-1]['remote']
+                    else:
+                        remoteCache.pop(mapTileFileUrl, None)
+                outcomes[tile_outcome(results[1:])] += 1
+                for stage, seconds in results[-1].get('timings', {}).items():
+                    stageTimes[stage].append(seconds)
+
+                elapsed = time.monotonic()-runStart
+                tileRate = handled/elapsed
+                eta = str(datetime.timedelta(seconds=int((lengthInputList-handled)/tileRate))) if tileRate > 0 else '-'
+                print('Completed {0} of {1} {2} % | {3:.2f} tiles/s {4:.2f} MB/s ETA {5}'.format(handled, lengthInputList,100.*(float(handled)/lengthInputList), tileRate, runBytes['download']/1024./1024./elapsed, eta))
+
+    finally:
+        #on an interrupt the queued tiles are dropped instead of being worked off on the way out
+        executor.shutdown(cancel_futures=True)
+        copyExecutor.shutdown(cancel_futures=True)
+        if extractExecutor != None:
+            extractExecutor.shutdown(cancel_futures=True)
+        journalFile.close()
+        session.pool.close()
+        save_remote_cache(remoteCache, remoteCachePath)
+
+    #the manifests are rebuilt from the journal, so they include the tiles of interrupted earlier attempts
+    downloadDict = read_journal(journalPath)
 
     now = datetime.datetime.now()
-    legacyjs = '/downloadList'+'-'+str(tag)+'-'+str(now.timestamp())+'.js'
-    currentjs = '/downloadList'+'-'+str(tag)+'-latest.js'
+    legacyjs = '/downloadList'+'-'+manifestTag+'-'+str(now.timestamp())+'.js'
+    currentjs = '/downloadList'+'-'+manifestTag+'-latest.js'
 
 
     with  open(outputDir+legacyjs,'w') as dlfile:
@@ -249,49 +1424,305 @@ def run(localFilesPath,outputDir, baseurl, suffix, numberProcs tag, inputList=[]
     with  open(outputDir+currentjs,'w') as dlfile:
         dlfile.write(json.dumps(downloadDict,indent=4))
 
+    elapsed = time.monotonic()-runStart
+    summary = {'tag':manifestTag,
+               'finished':now.isoformat(),
+               'seconds':elapsed,
+               'tiles':lengthInputList,
+               'handled':handled,
+               'outcomes':outcomes,
+               'bytes':runBytes,
+               'tilesPerSecond':handled/elapsed if elapsed > 0 else None,
+               'megabytesPerSecond':runBytes['download']/1024./1024./elapsed if elapsed > 0 else None,
+               'stages':{stage:stage_statistics(seconds) for stage, seconds in stageTimes.items()}}
+    write_metrics(summary, os.path.join(outputDir, 'downloadList-'+manifestTag+'-metrics.json'), os.path.join(outputDir, 'downloadList-'+manifestTag+'.prom'))
+    print('{} tiles in {:.1f} seconds: {} downloaded, {} copied, {} skipped, {} failed, {:.1f} MB received'.format(handled, elapsed, outcomes['downloaded'], outcomes['copied'], outcomes['skipped'], outcomes['failed'], runBytes['download']/1024./1024.))
+
+
+
+def read_journal(journalPath):
+
+    journal = {}
+    if os.path.isfile(journalPath):
+        with open(journalPath,'r') as journalfile:
+            for line in journalfile:
+                try:
+                    results = json.loads(line)
+                except ValueError:
+                    #last line of a run that was killed mid-write
+                    continue
+                journal[results[0]] = results[1:]
+    return journal
+
+
+def tile_failed(tileResults):
+
+    processIndex, wasDownloaded, downloadSucceded, wasCopied, copySucceded, tileInfo = tileResults
+    return ('error' in tileInfo) or (wasDownloaded and not downloadSucceded) or (wasCopied and not copySucceded) or (tileInfo.get('extract', {}).get('success') == False)
+
+
+def tile_outcome(tileResults):
+
+    processIndex, wasDownloaded, downloadSucceded, wasCopied, copySucceded, tileInfo = tileResults
+    if tile_failed(tileResults):
+        return 'failed'
+    elif wasDownloaded:
+        return 'downloaded'
+    elif wasCopied:
+        return 'copied'
+    return 'skipped'
+
+
+def stage_statistics(seconds):
+
+    if len(seconds) == 0:
+        return {'count':0, 'total':0.}
+    return {'count':len(seconds),
+            'total':float(np.sum(seconds)),
+            'p50':float(np.percentile(seconds, 50)),
+            'p90':float(np.percentile(seconds, 90)),
+            'p99':float(np.percentile(seconds, 99)),
+            'max':float(np.max(seconds))}
+
+
+def write_metrics(summary, metricsPath, promPath):
+
+    #the .json summary is not picked up as a manifest by --merge; the .prom file is for the node exporter textfile collector
+    with open(metricsPath,'w') as metricsfile:
+        metricsfile.write(json.dumps(summary,indent=4))
+
+    tag = summary['tag'].replace('\\','\\\\').replace('"','\\"')
+    lines = ['# HELP downloadahn_tiles Tiles handled by the last run, by outcome.',
+             '# TYPE downloadahn_tiles gauge']
+    lines += ['downloadahn_tiles{{tag="{}",outcome="{}"}} {}'.format(tag, outcome, count) for outcome, count in summary['outcomes'].items()]
+    lines += ['# HELP downloadahn_bytes Bytes downloaded and copied by the last run.',
+              '# TYPE downloadahn_bytes gauge']
+    lines += ['downloadahn_bytes{{tag="{}",kind="{}"}} {}'.format(tag, kind, count) for kind, count in summary['bytes'].items()]
+    lines += ['# HELP downloadahn_run_seconds Duration of the last run.',
+              '# TYPE downloadahn_run_seconds gauge',
+              'downloadahn_run_seconds{{tag="{}"}} {}'.format(tag, summary['seconds']),
+              '# HELP downloadahn_tiles_per_second Tile throughput of the last run.',
+              '# TYPE downloadahn_tiles_per_second gauge',
+              'downloadahn_tiles_per_second{{tag="{}"}} {}'.format(tag, summary['tilesPerSecond'] or 0),
+              '# HELP downloadahn_download_bytes_per_second Download throughput of the last run.',
+              '# TYPE downloadahn_download_bytes_per_second gauge',
+              'downloadahn_download_bytes_per_second{{tag="{}"}} {}'.format(tag, summary['bytes']['download']/summary['seconds'] if summary['seconds'] > 0 else 0),
+              '# HELP downloadahn_stage_seconds Time per tile spent in each stage of the last run.',
+              '# TYPE downloadahn_stage_seconds summary']
+    for stage, statistics in summary['stages'].items():
+        for quantile in ('p50', 'p90', 'p99'):
+            if quantile in statistics:
+                lines.append('downloadahn_stage_seconds{{tag="{}",stage="{}",quantile="0.{}"}} {}'.format(tag, stage, quantile[1:], statistics[quantile]))
+        lines.append('downloadahn_stage_seconds_sum{{tag="{}",stage="{}"}} {}'.format(tag, stage, statistics['total']))
+        lines.append('downloadahn_stage_seconds_count{{tag="{}",stage="{}"}} {}'.format(tag, stage, statistics['count']))
+    lines += ['# HELP downloadahn_last_run_timestamp_seconds Time the last run finished.',
+              '# TYPE downloadahn_last_run_timestamp_seconds gauge',
+              'downloadahn_last_run_timestamp_seconds{{tag="{}"}} {}'.format(tag, time.time())]
+
+    #written aside and renamed, so the collector never reads half a file
+    with open(promPath+'.tmp','w') as promfile:
+        promfile.write('\n'.join(lines)+'\n')
+    os.replace(promPath+'.tmp', promPath)
+
+
+def init_tile_worker(workerCounter):
+    workerState.index = next(workerCounter)
+
+
+def runTileDownloadTask(mapTile,localFilesPath,outputDir, baseurl, suffix,copylocal,session):
+    if session.claimDir != None and not claim_tile(session.claimDir, mapTile, session.nodeId):
+        return None
+    try:
+        wasDownloaded, downloadSucceded, wasCopied, copySucceded, tileInfo = maptile_downloader(mapTile,localFilesPath,outputDir, baseurl, suffix,copylocal,session)
+    except (OSError, http.client.HTTPException, RetryableError) as e:
+        print('processing of mapTile {} failed: {}'.format(mapTile, e))
+        wasDownloaded, downloadSucceded, wasCopied, copySucceded, tileInfo = False, False, False, False, {'error':'{}: {}'.format(type(e).__name__, e)}
+    except Exception as e:
+        #one broken tile must not take the whole run down
+        print('processing of mapTile {} failed'.format(mapTile))
+        print(traceback.format_exc())
+        wasDownloaded, downloadSucceded, wasCopied, copySucceded, tileInfo = False, False, False, False, {'error':'{}: {}'.format(type(e).__name__, e)}
+    return [mapTile, workerState.index, wasDownloaded, downloadSucceded , wasCopied, copySucceded, tileInfo]
 
 
+def runTileCopyTask(mapTile, suffix, localFilesPath, outputDir, session):
+    t0 = time.perf_counter()
+    copySuccess, strategyUsed = copy_execute(mapTile, suffix, localFilesPath, outputDir, session)
+    copyTime = time.perf_counter()-t0
+    copiedBytes = os.path.getsize(os.path.join(outputDir, build_filename(mapTile, suffix))) if copySuccess else 0
+    return copySuccess, strategyUsed, copyTime, copiedBytes
 
 
 
-def runTileDownloadProc(processIndex,tasksQueue,resultsQueue,localFilesPath,outputDir, baseurl, suffix,copylocal):
-    kill_received = False
-    while not kill_received:
-        mapTile=None
-        try:
-            #this waits until new job is available
-            mapTile = tasksQueue.get()
-        except:
-            #quit on Error
-            kill_received=True
+def parse_shard(shardSpec):
+
+    shardIndex, sep, shardCount = shardSpec.partition('/')
+    shardIndex, shardCount = int(shardIndex), int(shardCount)
+    if not 0 <= shardIndex < shardCount:
+        raise ValueError('shard must be i/N with 0 <= i < N, got {}'.format(shardSpec))
+    return shardIndex, shardCount
 
-        if mapTile == None:
-            #terminate on None job
-            kill_received=True
+
+def assign_shards(mapList, shardCount, tileSizes):
+
+    #greedy largest-first assignment to the least loaded shard. Sizes must be the same on every node;
+    #unknown sizes count as the median, ties are broken by a stable hash so every node computes the same split
+    knownSizes = sorted(size for size in tileSizes.values() if size != None)
+    defaultSize = knownSizes[len(knownSizes)//2] if knownSizes else 1
+    weightedTiles = sorted(mapList, key=lambda mapTile: (-(tileSizes.get(mapTile) or defaultSize), hashlib.md5(mapTile.encode('utf-8')).hexdigest()))
+
+    shardLoads = [0]*shardCount
+    subMapLists = [[] for i in range(shardCount)]
+    for mapTile in weightedTiles:
+        shardIndex = shardLoads.index(min(shardLoads))
+        subMapLists[shardIndex].append(mapTile)
+        shardLoads[shardIndex] += tileSizes.get(mapTile) or defaultSize
+
+    return subMapLists
+
+
+def claim_tile(claimDir, mapTile, nodeId):
+
+    #the lock is linked into place with the owner already written: link is atomic, also on NFS, so exactly one
+    #node wins each tile and a crash can never leave a lock without its owner
+    claimPath = os.path.join(claimDir, mapTile+'.lock')
+    tmpClaimPath = '{}.{}.tmp'.format(claimPath, nodeId.replace('/', 'of'))
+    with open(tmpClaimPath,'w') as claimfile:
+        claimfile.write(nodeId)
+    try:
+        os.link(tmpClaimPath, claimPath)
+    except FileExistsError:
+        with open(claimPath,'r') as claimfile:
+            return claimfile.read() == nodeId
+    finally:
+        os.remove(tmpClaimPath)
+    return True
+
+
+def merge_manifests(manifestPaths, tag, outputDir):
+
+    mergedName = 'downloadList-{}-merged.js'.format(tag)
+    manifestFiles = []
+    for manifestPath in manifestPaths:
+        if os.path.isdir(manifestPath):
+            manifestFiles += glob.glob(os.path.join(manifestPath, 'downloadList-{}-*.js'.format(glob.escape(tag))))
         else:
-            wasDownloaded, downloadSucceded, wasCopied, copySucceded = maptile_downloader(mapTile,localFilesPath,outputDir, baseurl, suffix,copylocal)
-            resultsQueue.put([mapTile, processIndex, wasDownloaded, downloadSucceded , wasCopied, copySucceded])
+            manifestFiles.append(manifestPath)
+    manifestFiles = [manifestFile for manifestFile in manifestFiles if os.path.basename(manifestFile) != mergedName]
 
+    #oldest first, so the most recent result of a tile wins
+    mergedDict = {}
+    for manifestFile in sorted(manifestFiles, key=os.path.getmtime):
+        with open(manifestFile,'r') as dlfile:
+            mergedDict.update(json.load(dlfile))
+    print('merged {} manifests with {} tiles'.format(len(manifestFiles), len(mergedDict)))
 
+    with open(os.path.join(outputDir, mergedName),'w') as dlfile:
+        dlfile.write(json.dumps(mergedDict,indent=4))
 
-def split_input_list(nSplit,mapList):
 
-    subMapLists =[]
-    lengthMapList = len(mapList)
-    lengthSubMapList = np.int(np.floor(lengthMapList/nSplit))
-    lengthFinSubMapList = lengthMapList - ((nSplit-1)*lengthSubMapList)
+def load_sheet_index(sheetIndexPath):
 
-    for i in range(nSplit):
-        if i != (nSplit-1):
-            subMapList = mapList[i*lengthSubMapList:(i+1)*lengthSubMapList]
-        else :
-            subMapList = mapList[i*lengthSubMapList:]
+    with open(sheetIndexPath,'r') as indexfile:
+        sheetIndex = json.load(indexfile)
+    return {int(sheet):(float(origin[0]), float(origin[1])) for sheet, origin in sheetIndex.items()}
 
-        subMapLists.append(subMapList)
 
-    return subMapLists
+def tile_bounds(top10nlMapTile, sheetIndex):
+
+    sheetX, sheetY = sheetIndex[int(top10nlMapTile[:2])]
+    quadrant = SHEET_LETTERS.index(top10nlMapTile[2].upper())
+    xmin = sheetX+(quadrant//4)*SHEET_WIDTH/2+(quadrant%2)*SHEET_WIDTH/4+(top10nlMapTile[4] == '2')*TILE_WIDTH
+    ymin = sheetY+((quadrant%4) < 2)*SHEET_HEIGHT/2+(top10nlMapTile[3].upper() == 'N')*TILE_HEIGHT
+    return xmin, ymin, xmin+TILE_WIDTH, ymin+TILE_HEIGHT
+
+
+def parse_bbox(bboxSpec):
+
+    xmin, ymin, xmax, ymax = [float(value) for value in bboxSpec.split(',')]
+    if xmin >= xmax or ymin >= ymax:
+        raise ValueError('bbox must be xmin,ymin,xmax,ymax with xmin < xmax and ymin < ymax, got {}'.format(bboxSpec))
+    return [[(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]]
 
 
+def read_polygon(polygonPath):
+
+    #all rings of a GeoJSON (Multi)Polygon, Feature or FeatureCollection; holes work through the even-odd rule
+    with open(polygonPath,'r') as polygonfile:
+        geometries = [json.load(polygonfile)]
+    rings = []
+    while geometries:
+        geometry = geometries.pop()
+        if geometry['type'] == 'FeatureCollection':
+            geometries += [feature['geometry'] for feature in geometry['features']]
+        elif geometry['type'] == 'Feature':
+            geometries.append(geometry['geometry'])
+        elif geometry['type'] == 'Polygon':
+            rings += [[tuple(point[:2]) for point in ring] for ring in geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            rings += [[tuple(point[:2]) for point in ring] for polygon in geometry['coordinates'] for ring in polygon]
+        else:
+            raise ValueError('unsupported geometry type {} in {}'.format(geometry['type'], polygonPath))
+    return rings
+
+
+def point_in_rings(x, y, rings):
+
+    inside = False
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:]+ring[:1]):
+            if (y0 > y) != (y1 > y) and x < x0+(y-y0)*(x1-x0)/(y1-y0):
+                inside = not inside
+    return inside
+
+
+def segment_crosses_rectangle(x0, y0, x1, y1, rectangle):
+
+    #Liang-Barsky clipping; touching the border of the rectangle does not count
+    xmin, ymin, xmax, ymax = rectangle
+    dx, dy = x1-x0, y1-y0
+    t0, t1 = 0., 1.
+    for p, q in ((-dx, x0-xmin), (dx, xmax-x0), (-dy, y0-ymin), (dy, ymax-y0)):
+        if p == 0:
+            if q < 0:
+                return False
+        elif p < 0:
+            t0 = max(t0, q/p)
+        else:
+            t1 = min(t1, q/p)
+    if t0 > t1:
+        return False
+    xm, ym = x0+(t0+t1)/2*dx, y0+(t0+t1)/2*dy
+    return xmin < xm < xmax and ymin < ym < ymax
+
+
+def rectangle_intersects_rings(rectangle, rings):
+
+    #either an edge of the region passes through the rectangle, or the rectangle lies entirely inside or outside of it
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:]+ring[:1]):
+            if segment_crosses_rectangle(x0, y0, x1, y1, rectangle):
+                return True
+    xmin, ymin, xmax, ymax = rectangle
+    return point_in_rings((xmin+xmax)/2, (ymin+ymax)/2, rings)
+
+
+def tiles_in_region(rings, sheetIndex):
+
+    points = [point for ring in rings for point in ring]
+    regionBounds = (min(x for x, y in points), min(y for x, y in points), max(x for x, y in points), max(y for x, y in points))
+    regionTiles = []
+    for sheet, (sheetX, sheetY) in sorted(sheetIndex.items()):
+        if sheetX >= regionBounds[2] or sheetX+SHEET_WIDTH <= regionBounds[0] or sheetY >= regionBounds[3] or sheetY+SHEET_HEIGHT <= regionBounds[1]:
+            continue
+        for letter in SHEET_LETTERS:
+            for half in 'NZ':
+                for column in '12':
+                    mapTile = '{:02d}{}{}{}'.format(sheet, letter, half, column)
+                    if rectangle_intersects_rings(tile_bounds(mapTile, sheetIndex), rings):
+                        regionTiles.append(mapTile)
+    return regionTiles
+
 
 def download_list_top10nl():
     top10nlMapTiles = ['11HZ1', '11HZ2', '43BN1', '43BN2', '10HN2', '02GN2', '02GN1', '07BN1', '07BN2', '69AZ2', '69AZ1', '43FN1', '43FN2', '13CN1', '13CN2', '28AZ1', '28AZ2', '52BZ2', '29AN2', '29AN1', '52BZ1', '40HZ2', '40HZ1', '49GZ2', '49GZ1', '29CN1', '01HN1', '01HN2', '29CN2', '37AZ1', '37AZ2', '08CN1', '08CN2', '12HN1', '12HN2', '49FN2', '49FN1', '13AN2', '13AN1', '68CN2', '21CN1', '50EZ2', '50EZ1', '21CN2', '20FN2', '20FN1', '40CN1', '40CN2', '68EN1', '68EN2', '41EZ1', '41EZ2', '10HZ2', '21DZ2', '20BN2', '20BN1', '21DZ1', '41CZ2', '41CZ1', '10HZ1', '21FZ1', '21FZ2', '14BN1', '14BN2', '49CZ2', '49CZ1', '33EN1', '33EN2', '34DZ1', '34DZ2', '33CN2', '33CN1', '33AN1', '33AN2', '39FN1', '39FN2', '41DZ1', '39HN2', '39HN1', '46CN2', '46CN1', '07DN2', '07DN1', '65BN1', '65BN2', '14EZ2', '14EZ1', '37HN1', '46AN1', '46AN2', '37HN2', '07FN1', '07FN2', '34FZ2', '34FZ1', '14DN2', '14DN1', '70FZ2', '14FN1', '41FZ1', '57FZ1', '19CZ1', '57FZ2', '25DZ2', '25DZ1', '25FZ1', '25FZ2', '23AZ1', '23AZ2', '27EZ1', '27EZ2', '67AZ1', '02EZ2', '67AZ2', '40DN2', '40DN1', '15FZ2', '15FZ1', '45AZ1', '45AZ2', '40FN1', '40FN2', '45GZ2', '45GZ1', '11DZ1', '11DZ2', '24HZ1', '27DN1', '27DN2', '24HZ2', '67DN1', '67DN2', '38EZ1', '38EZ2', '04EZ2', '11BZ2', '11BZ1', '27CZ2', '27CZ1', '67BN2', '67BN1', '67GZ2', '67GZ1', '50AZ2', '50AZ1', '69BN1', '69BN2', '17GN1', '17GN2', '69DN2', '69DN1', '31FN1', '31FN2', '17AN2', '10EZ2', '10EZ1', '17AN1', '17CN1', '17CN2', '26CN1', '26CN2', '33FN2', '33FN1', '26EN2', '33DN2', '22GN1', '22GN2', '52HN1', '22AN2', '22AN1', '25HN2', '45HN1', '45HN2', '25HN1', '58BN1', '58BN2', '32AZ2', '32AZ1', '22CN1', '22CN2', '12EN1', '12EN2', '50DN2', '21BZ1', '21BZ2', '50DN1', '65EN2', '65EN1', '66FZ1', '66FZ2', '65GN1', '65GN2', '26AN2', '65AN2', '65AN1', '21HZ1', '34CN2', '11GZ2', '11GZ1', '11EZ1', '11EZ2', '49HN1', '49HN2', '10BZ2', '19DZ1', '19DZ2', '19BZ2', '19BZ1', '43GN1', '43GN2', '20DZ1', '20DZ2', '02FZ2', '02FZ1', '09EN1', '43EN2', '43EN1', '11HN1', '11HN2', '32GN1', '28GN2', '28GN1', '32GN2', '28EN1', '28EN2', '37GN2', '37GN1', '37EN1', '37EN2', '58HZ1', '28AN1', '28AN2', '68DN1', '68DN2', '52AN1', '52AN2', '49DZ1', '49DZ2', '37AN1', '37AN2', '40AZ2', '40AZ1', '40CZ1', '40CZ2', '57EN2', '57EN1', '68HN1', '31HZ2', '31HZ1', '57GN2', '68FN2', '68FN1', '15HN1', '15HN2', '20FZ2', '20FZ1', '38DN1', '38DN2', '32HN2', '32HN1', '33AZ1', '33AZ2', '17DN2', '17DN1', '44DN2', '44DN1', '17FN1', '32FN1', '32FN2', '17FN2', '44FN1', '44FN2', '33DZ1', '15BZ2', '46AZ1', '46AZ2', '33DZ2', '34FN2', '45BN2', '34FN1', '46DN1', '22DN2', '22DN1', '46DN2', '65BZ1', '65BZ2', '34DN1', '34DN2', '45BN1', '45BZ2', '45BZ1', '15CZ2', '34CN1', '15CZ1', '33CZ2', '33CZ1', '34BN2', '34BN1', '39BZ1', '39BZ2', '41FN1', '39DZ2', '39DZ1', '41DN1', '41DN2', '46CZ2', '46CZ1', '41BN2', '28BN2', '28BN1', '41BN1', '20AZ1', '44BZ2', '50FZ1', '50FZ2', '05GZ2', '05GZ1', '30EZ1', '30EZ2', '06GN2', '05HN1', '05HN2', '06GN1', '16GZ2', '16GZ1', '57BN1', '57BN2', '30FN2', '30FN1', '05FN2', '06BZ2', '06BZ1', '05FN1', '30DN2', '64DZ2', '67GN2', '67GN1', '27AN1', '27AN2', '27GN2', '27GN1', '67EN1', '67EN2', '06CN2', '06CN1', '64EN2', '06AN1', '06AN2', '23AN1', '23AN2', '58AN2', '58AN1', '67HZ1', '67HZ2', '38AN1', '38AN2', '38GN2', '38GN1', '39AZ2', '39AZ1', '43CZ1', '27HZ1', '27HZ2', '43CZ2', '27FZ2', '27FZ1', '39CZ1', '39CZ2', '24FN2', '67BZ2', '67BZ1', '24HN1', '27DZ1', '27DZ2', '24HN2', '27CN2', '27CN1', '17BZ1', '17BZ2', '32AN2', '32AN1', '19GZ2', '38HZ1', '38HZ2', '19GZ1', '31BZ1', '31BZ2', '32CN1', '58EN2', '58EN1', '32CN2', '32EN2', '32EN1', '19EZ1', '19EZ2', '58GN1', '31DZ2', '31DZ1', '58GN2', '26FZ1', '26FZ2', '26HZ2', '26HZ1', '01GZ2', '01GZ1', '12AZ1', '11EN1', '11EN2', '12AZ2', '50HZ2', '50HZ1', '11CN2', '12GZ2', '12GZ1', '11CN1', '03DN2', '03DN1', '10BN1', '10BN2', '18CZ1', '18CZ2', '44HZ2', '44HZ1', '10DN2', '10DN1', '11GN2', '11GN1', '10FN1', '10FN2', '15EZ1', '15EZ2', '20HN1', '20HN2', '33HN1', '51CN2', '20EZ2', '51CN1', '02DN1', '51BZ2', '51BZ1', '20DN2', '43GZ1', '43GZ2', '33HN2', '09AZ2', '09GZ2', '65CN1', '65HN2', '65HN1', '28HZ2', '69FN1', '06HZ1', '06HZ2', '69HN1', '30HZ1', '30HZ2', '49DN1', '49DN2', '33HZ2', '28DZ1', '28DZ2', '49BN2', '49BN1', '37BN2', '37BN1', '22FN1', '52EZ1', '52EZ2', '22FN2', '09HN2', '43DZ2', '52CZ2', '52CZ1', '43DZ1', '68DZ1', '68DZ2', '16HN1', '16HN2', '16FN2', '16FN1', '57EZ2', '57EZ1', '21BN1', '21BN2', '40BN1', '40BN2', '32DZ2', '32DZ1', '25AZ2', '25AZ1', '17FZ1', '32FZ1', '32FZ2', '17FZ2', '38FZ2', '21EZ2', '21EZ1', '38FZ1', '38DZ1', '38DZ2', '22BZ1', '22BZ2', '17HZ2', '17HZ1', '22FZ1', '10CN1', '22FZ2', '58CZ1', '58CZ2', '44BZ1', '10CN2', '68GZ2', '68GZ1', '44DZ2', '44DZ1', '07AN2', '07AN1', '26GN1', '26GN2', '33BN2', '33BN1', '34AZ1', '16CZ2', '16CZ1', '34AZ2', '51FZ2', '51FZ1', '50BN1', '50BN2', '28HZ1', '65CN2', '07EN2', '07EN1', '34GZ2', '34GZ1', '07GN1', '07GN2', '30DZ1', '30DZ2', '17EZ2', '17EZ1', '31AZ2', '31AZ1', '31CZ1', '31CZ2', '50FN1', '50FN2', '64GZ2', '64GZ1', '64EZ2', '44AZ2', '05DZ2', '44AZ1', '25EZ2', '25EZ1', '30FZ2', '64FN2', '64FN1', '30FZ1', '35AN2', '44CZ1', '44CZ2', '35AN1', '06GZ2', '05HZ1', '05HZ2', '06GZ1', '39CN1', '39CN2', '43AN2', '43AN1', '18BZ1', '39EN2', '39EN1', '43CN1', '27HN1', '27HN2', '43CN2', '12BZ2', '12BZ1', '16DZ1', '16DZ2', '02CZ2', '02CZ1', '18HZ2', '51AZ1', '21HN2', '58GZ1', '04DZ2', '43BZ2', '58GZ2', '19GN2', '38HN1', '38HN2', '19GN1', '58AZ2', '58AZ1', '39AN2', '39AN1', '13BN1', '69AN2', '69AN1', '13BN2', '13DN2', '13DN1', '69CN2', '69EN2', '69EN1', '17BN1', '17BN2', '26BN1', '29AZ2', '29AZ1', '26BN2', '26DN2', '26DN1', '49GN2', '49GN1', '08DN2', '08DN1', '49EN1', '37DZ2', '50GN1', '50GN2', '68BN2', '68BN1', '07HZ2', '09BZ2', '09BZ1', '68CZ2', '58DZ2', '58DZ1', '50EN2', '50EN1', '66HN2', '66HN1', '55EN1', '55EN2', '52DZ1', '52DZ2', '55CN1', '55AN1', '55AN2', '21DN2', '21DN1', '51HN1', '51HN2', '21FN1', '21FN2', '52FZ1', '14AN2', '28FN2', '28FN1', '28DN1', '46BN2', '46BN1', '28DN2', '41AZ1', '41AZ2', '49AZ1', '49AZ2', '49EZ1', '07CZ1', '07CZ2', '37HZ1', '37DN2', '51AZ2', '19HZ1', '14EN2', '14EN1', '14HZ1', '36HN2', '19HZ2', '14GN1', '14GN2', '22EZ2', '22EZ1', '43BZ1', '43HN2', '43HN1', '57FN1', '57FN2', '28CZ2', '28CZ1', '16HZ1', '16HZ2', '27EN1', '27EN2', '67CN2', '67CN1', '40FZ1', '40FZ2', '67AN1', '67AN2', '37CZ2', '06EN1', '06EN2', '37CZ1', '38EN1', '10BZ1', '38EN2', '58BZ1', '58BZ2', '45EZ1', '45EZ2', '17AZ2', '17AZ1', '25BZ1', '25BZ2', '58CN1', '17CZ1', '17CZ2', '58CN2', '22BN1', '22BN2', '07GZ1', '52HZ1', '07GZ2', '03CZ1', '03CZ2', '34GN2', '34GN1', '22AZ2', '45CZ2', '45CZ1', '22AZ1', '07AZ2', '07AZ1', '26EZ2', '14HN2', '15BZ1', '26EZ1', '34EN1', '34EN2', '22CZ1', '22CZ2', '26GZ1', '26GZ2', '14HN1', '33BZ2', '33BZ1', '10GZ1', '11AN1', '11AN2', '10GZ2', '31AN2', '11FZ2', '11FZ1', '31AN1', '65GZ1', '65GZ2', '65AZ2', '65AZ1', '44AN2', '24FZ2', '05DN2', '44AN1', '05BN1', '12FN2', '12FN1', '16DN1', '16DN2', '16BN2', '16BN1', '51GN2', '51GN1', '31DN2', '51EN1', '51EN2', '18BN1', '31DN1', '12BN2', '12BN1', '69EZ2', '69EZ1', '03HZ2', '03HZ1', '55BZ1', '51AN1', '51AN2', '28GZ2', '28GZ1', '37FN2', '37FN1', '28EZ1', '28EZ2', '37DN1', '49EZ2', '07HN2', '07HN1', '19FZ2', '19FZ1', '04GZ1', '57HZ2', '57HZ1', '37GZ2', '37GZ1', '37EZ1', '37EZ2', '09BN2', '09BN1', '14CZ1', '14CZ2', '08DZ2', '08DZ1', '03GN1', '50GZ2', '55AZ1', '55AZ2', '40HN2', '40HN1', '50GZ1', '37DZ1', '03GN2', '49EN2', '31HN2', '31HN1', '52FN1', '49FZ2', '49FZ1', '52DN1', '52DN2', '15HZ1', '15HZ2', '52BN2', '52BN1', '08AZ2', '08AZ1', '08CZ1', '08CZ2', '15GN2', '34BZ2', '34BZ1', '40GZ1', '40GZ2', '03GZ1', '45FN2', '45FN1', '03GZ2', '45DN1', '45DN2', '20GN2', '20GN1', '41BZ2', '41BZ1', '14GZ1', '14GZ2', '56FN2', '41GN2', '41GN1', '14AZ2', '46DZ1', '20BZ2', '20BZ1', '46DZ2', '41EN1', '38CN2', '41CN2', '41CN1', '38CN1', '40EZ2', '46BZ2', '46BZ1', '40EZ1', '49CN2', '49CN1', '07CN1', '20AN1', '20AN2', '07CN2', '49AN1', '49AN2', '06FN2', '06FN1', '64HN1', '64HN2', '05GN2', '05GN1', '30GN2', '30GN1', '30EN2', '39FZ1', '65FZ1', '65FZ2', '39FZ2', '39HZ2', '39HZ1', '16GN2', '16GN1', '64DN2', '16EN1', '33GZ1', '57BZ1', '57BZ2', '07DZ2', '06BN2', '06BN1', '07DZ1', '33EZ1', '33EZ2', '07FZ1', '07FZ2', '27AZ1', '27AZ2', '39GN1', '39GN2', '27GZ2', '27GZ1', '46GZ2', '46GZ1', '67EZ1', '67EZ2', '14DZ2', '14DZ1', '46EZ1', '65DZ2', '14FZ1', '14FZ2', '65DZ1', '38AZ1', '38AZ2', '19EN1', '19EN2', '38GZ2', '38GZ1', '38CZ2', '25BN1', '25BN2', '19CN2', '38CZ1', '19CN1', '25DN2', '19AN1', '19AN2', '25DN1', '25FN1', '25FN2', '45CN2', '45CN1', '45AN1', '45AN2', '32CZ1', '32CZ2', '32EZ2', '32EZ1', '26FN1', '26FN2', '32GZ1', '11DN1', '11DN2', '11BN2', '11BN1', '26HN2', '26HN1', '32GZ2', '50AN2', '50AN1', '31FZ1', '31FZ2', '50CN1', '50CN2', '27BZ2', '69BZ1', '69BZ2', '27BZ1', '03DZ2', '03DZ1', '67FZ2', '67FZ1', '11CZ2', '10EN2', '10EN1', '11CZ1', '10GN1', '11AZ1', '11AZ2', '10GN2', '11FN2', '11FN1', '10DZ2', '44HN2', '44HN1', '10FZ1', '10FZ2', '45HZ1', '45HZ2', '02HZ1', '40GN1', '12EZ1', '12EZ2', '66FN1', '66FN2', '01CZ2', '01CZ1', '20HZ1', '20HZ2', '33DN1', '02DZ1', '02DZ2', '26EN1', '12CZ2', '12CZ1', '09DN1', '50DZ2', '51BN2', '51BN1', '50DZ1', '19FN2', '19FN1', '69GN1', '69GN2', '19DN1', '19DN2', '04GN1', '04GN2', '34HN1', '34HN2', '03HN2', '03HN1', '18AZ2', '18AZ1', '65HZ2', '65HZ1', '07BZ1', '07BZ2', '41HN1', '69FZ1', '19HN1', '30HN1', '30HN2', '07HZ1', '43DN2', '14BZ1', '14BZ2', '43DN1', '09EZ1', '49BZ2', '49BZ1', '14HZ2', '43EZ2', '43EZ1', '14CN2', '09CZ2', '31EZ1', '06DZ1', '06DZ2', '21AN2', '21AN1', '55BN1', '08AN1', '52AZ1', '52AZ2', '45DZ1', '45DZ2', '68GN2', '68GN1', '25AN2', '25AN1', '25CN1', '25CN2', '68HZ1', '21EN2', '21EN1', '52GZ2', '52GZ1', '21GN1', '21GN2', '40EN2', '40EN1', '21HZ2', '40GN2', '57AZ2', '57AZ1', '45FZ2', '45FZ1', '40AN2', '40AN1', '15GZ2', '34AN1', '34AN2', '17DZ2', '17DZ1', '20GZ2', '20GZ1', '31CN1', '31CN2', '32BZ1', '32BZ2', '50BZ1', '50BZ2', '44FZ1', '44FZ2', '05EZ2', '31EN2', '31EN1', '38BZ2', '31GN1', '31GN2', '32HZ2', '32HZ1', '38BZ1', '16AZ1', '16AZ2', '44CN1', '44CN2', '35AZ1', '22DZ2', '22DZ1', '16EZ1', '16EZ2', '44EN2', '44EN1', '06FZ2', '06FZ1', '17EN2', '17EN1', '44GN1', '44GN2', '64HZ1', '64HZ2', '30GZ2', '30GZ1', '12DN1', '12DN2', '39BN1', '39BN2', '65DN2', '39DN2', '39DN1', '65DN1', '46GN2', '46GN1', '65FN1', '65FN2', '28BZ2', '28BZ1', '64FZ2', '64FZ1', '19AZ1', '19AZ2', '43AZ2', '43AZ1', '51DZ1', '51DZ2', '39EZ2', '39EZ1', '39GZ1', '39GZ2', '25GZ1', '25GZ2', '05FZ2', '04DN2', '05FZ1', '41EN2', '04FN2', '26AZ2', '19CZ2', '10HN1', '21HN1', '13BZ1', '13BZ2', '13DZ2', '13DZ1', '06CZ2', '06CZ1', '06AZ1', '06AZ2', '26BZ1', '26BZ2', '36FZ2', '65CZ1', '02HZ2', '33GN2', '27FN2', '26DZ2', '26DZ1', '27FN1', '67FN2', '67FN1', '02GZ2', '02GZ1', '33GN1', '02EZ1', '09DN2', '43FZ1', '43FZ2', '68BZ2', '68BZ1', '31BN1', '31BN2', '58EZ2', '58EZ1', '27BN2', '27BN1', '67HN1', '67HN2', '01GN2', '01GN1', '58DN2', '58DN1', '58FN1', '05AN1', '05AN2', '12AN1', '12AN2', '12GN2', '12GN1', '13AZ2', '13AZ1', '29CZ1', '01HZ1', '01HZ2', '29CZ2', '13CZ1', '13CZ2', '02HN1', '01DZ1', '01DZ2', '02HN2', '21CZ1', '18AN2', '18AN1', '21CZ2', '51HZ1', '51HZ2', '12HZ1', '12HZ2', '18CN1', '18CN2', '50HN2', '50HN1', '12CN2', '12CN1', '68EZ1', '68EZ2', '28FZ2', '28FZ1', '41AN1', '41AN2', '15EN1', '15EN2', '09CN2', '43HZ2', '43HZ1', '51CZ2', '20EN2', '51CZ1', '28CN2', '28CN1', '06HN1', '06HN2', '22EN2', '22EN1', '37CN2', '06EZ1', '06EZ2', '37CN1', '06DN1', '37BZ2', '37BZ1', '06DN2', '65CZ2', '21GZ1', '21GZ2', '25CZ1', '25CZ2', '52GN2', '52GN1', '31EZ2', '21AZ2', '21AZ1', '52EN1', '52EN2', '52CN2', '52CN1', '09HZ1', '09HZ2', '37HZ2', '16FZ2', '16FZ1', '57AN2', '57AN1', '15FN2', '15FN1', '45GN2', '45GN1', '45EN1', '45EN2', '40BZ1', '40BZ2', '31GZ1', '31GZ2', '38FN2', '38FN1', '34EZ1', '34EZ2', '15BN2', '15BN1', '34CZ2', '34CZ1', '40DZ2', '40DZ1', '44GZ1', '44GZ2', '17HN2', '17HN1', '44BN1', '44BN2', '32BN1', '32BN2', '38BN2', '38BN1', '32DN2', '32DN1', '33GZ2', '25HZ2', '25HZ1', '17GZ1', '17GZ2', '16CN2', '16CN1', '16EN2', '44EZ2', '44EZ1', '16AN1', '16AN2', '51FN2', '51FN1', '03AZ1', '51DN1', '51DN2', '33HZ1', '26AZ1', '16BZ2', '33FZ2', '33FZ1', '16BZ1', '22GZ1', '12FZ2', '07EZ2', '07EZ1', '12FZ1', '28HN1', '26CZ1', '26CZ2', '28HN2', '12DZ1', '12DZ2', '51GZ2', '51GZ1', '10AZ2', '51EZ2', '04FZ1', '04FZ2', '65EZ2', '65EZ1', '51EZ1', '19BN2', '19BN1', '25EN2', '25EN1', '25GN1', '25GN2', '09DZ1', '09DZ2', '37FZ2', '37FZ1', '02CN2', '02CN1', '57HN2', '57HN1', '64GN2', '64GN1']
@@ -300,12 +1731,29 @@ def download_list_top10nl():
 
 
 def main():
-    args = argument_parser().parse_args()
+    parser = argument_parser()
+    args = parser.parse_args()
+
+    if args.merge != None:
+        #a random tag matches none of the manifests to merge
+        if args.tag == None:
+            parser.error('--merge requires -t/--tag')
+        merge_manifests(args.merge, args.tag, args.outputdirectory)
+        return
+    if args.localrepository == None or args.baseurl == None:
+        parser.error('the following arguments are required: -l/--localrepository, -u/--baseurl')
+    if args.resume != None:
+        args.tag = args.resume
+    elif args.tag == None:
+        args.tag = str(np.random.randint(200000))
+    if (args.bbox != None or args.polygon != None) and args.sheetindex == None:
+        parser.error('--bbox and --polygon require --sheetindex')
+
     print('local repository: ', args.localrepository)
     print('output directory/download destination : ',args.outputdirectory)
     print('base url : ',args.baseurl)
-    print('file suffix : ' args.suffix)
-    print('running {} processes'.format(args.proc))
+    print('file suffix : ', args.suffix)
+    print('running {} workers'.format(args.proc))
     print('copying from local repository: {}'.format(args.copylocal))
     print('run tag is {}'.format(args.tag))
     if args.inputlist != None:
@@ -315,11 +1763,23 @@ def main():
     
     if args.inputlist != None:
         allMapTiles = read_input(args.inputlist)
+    elif args.discover:
+        #discovery takes the tiles from the remote listing; a region alone is cut from the known tile list
+        allMapTiles = None
     else:
         allMapTiles = download_list_top10nl()
 
+    if args.bbox != None or args.polygon != None:
+        rings = parse_bbox(args.bbox) if args.bbox != None else read_polygon(args.polygon)
+        regionTiles = tiles_in_region(rings, load_sheet_index(args.sheetindex))
+        if allMapTiles != None:
+            regionTileSet = set(regionTiles)
+            regionTiles = [mapTile for mapTile in allMapTiles if mapTile in regionTileSet]
+        allMapTiles = regionTiles
+        print('{} tiles intersect the requested region'.format(len(allMapTiles)))
+
 
-    if len(allMapTiles) == 0:
+    if allMapTiles != None and len(allMapTiles) == 0:
         print('no tiles specified. aborting')
     else:
         
@@ -333,7 +1793,7 @@ def main():
             else :
                 print('no value for copylocal set')
 
-            run(args.localrepository, args.outputdirectory, args.baseurl, args.suffix, args.proc, args.tag, inputList=allMapTiles,copylocal=copylocal_val)
+            run(args.localrepository, args.outputdirectory, args.baseurl, args.suffix, args.proc, args.tag, inputList=allMapTiles,copylocal=copylocal_val,remoteCachePath=args.remotecache,maxPerHost=args.perhost,segments=args.segments,segmentThreshold=args.segmentthreshold,localIndexPath=args.localindex,reindex=args.reindex,maxRequestRate=args.maxrate,maxBandwidth=args.maxbandwidth,maxRetries=args.retries,shard=parse_shard(args.shard) if args.shard != None else None,shardDir=args.sharddir,resume=args.resume != None,copyStrategy=args.copystrategy,copyWorkers=args.copyworkers,extract=args.extract,extractWorkers=args.extractworkers,discover=args.discover,listingUrl=args.listingurl)
             print('finished in {} seconds'.format(time.time() - t0))
 
         except:
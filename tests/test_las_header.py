@@ -0,0 +1,43 @@
+import struct
+
+import pytest
+
+import downloader
+
+
+def las_header(versionMinor, pointFormat, legacyPointCount, pointCount=None):
+
+    #public header block laid out field by field after the LAS 1.2 and 1.4 specifications
+    header = struct.pack('<4sHH16sBB32s32sHHHIIBHI5I3d3d6d',
+                         b'LASF', 0, 0, b'\0'*16, 1, versionMinor, b'downloader'.ljust(32, b'\0'), b'test'.ljust(32, b'\0'),
+                         291, 2026, 375 if versionMinor >= 4 else 227, 375 if versionMinor >= 4 else 227, 0,
+                         pointFormat, 34, legacyPointCount, legacyPointCount, 0, 0, 0, 0,
+                         0.001, 0.001, 0.001, 90000., 525000., 0.,
+                         95000., 90000., 531250., 525000., 42.5, -3.25)
+    if versionMinor >= 4:
+        header += struct.pack('<QQIQ15Q', 0, 0, 0, pointCount, *([pointCount]+[0]*14))
+    return header
+
+
+def test_las_12_header():
+    header = las_header(2, 1, 1234567)
+    assert len(header) == 227
+    assert downloader.read_las_header(header) == {'version':'1.2', 'pointFormat':1, 'compressed':False, 'pointCount':1234567,
+                                                  'bbox':[90000., 525000., -3.25, 95000., 531250., 42.5]}
+
+
+def test_laz_14_header():
+    #LAZ sets the top bit of the point format; the legacy count is 0 beyond 2^32 points
+    header = las_header(4, 6 | 0x80, 0, 5000000000)
+    assert len(header) == 375
+    assert downloader.read_las_header(header) == {'version':'1.4', 'pointFormat':6, 'compressed':True, 'pointCount':5000000000,
+                                                  'bbox':[90000., 525000., -3.25, 95000., 531250., 42.5]}
+
+
+def test_invalid_headers():
+    with pytest.raises(ValueError):
+        downloader.read_las_header(b'PK\x03\x04'+las_header(2, 1, 10)[4:])
+    with pytest.raises(ValueError):
+        downloader.read_las_header(las_header(2, 1, 10)[:200])
+    with pytest.raises(ValueError):
+        downloader.read_las_header(las_header(2, 1, 0))
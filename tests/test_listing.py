@@ -0,0 +1,106 @@
+import contextlib
+
+import downloader
+
+
+NGINX_LISTING = '''<html>
+<head><title>Index of /ahn/</title></head>
+<body>
+<h1>Index of /ahn/</h1><hr><pre><a href="../">../</a>
+<a href="10hn2.laz.zip">10hn2.laz.zip</a>                                      18-Oct-2026 14:04             4001452
+<a href="11hz1.laz.zip">11hz1.laz.zip</a>                                      05-Jan-2023 10:12:31          3001150
+<a href="sub/">sub/</a>                                               05-Jan-2023 10:12                   -
+</pre><hr></body>
+</html>
+'''
+
+APACHE_LISTING = '''<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">
+<html>
+ <head>
+  <title>Index of /ahn</title>
+ </head>
+ <body>
+<h1>Index of /ahn</h1>
+  <table>
+   <tr><th valign="top"><img src="/icons/blank.gif" alt="[ICO]"></th><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th><th><a href="?C=S;O=A">Size</a></th><th><a href="?C=D;O=A">Description</a></th></tr>
+   <tr><th colspan="5"><hr></th></tr>
+<tr><td valign="top"><img src="/icons/back.gif" alt="[PARENTDIR]"></td><td><a href="/">Parent Directory</a></td><td>&nbsp;</td><td align="right">  - </td><td>&nbsp;</td></tr>
+<tr><td valign="top"><img src="/icons/compressed.gif" alt="[   ]"></td><td><a href="11hz1.laz.zip">11hz1.laz.zip</a></td><td align="right">2023-01-05 10:12  </td><td align="right">3001150</td><td>&nbsp;</td></tr>
+<tr><td valign="top"><img src="/icons/compressed.gif" alt="[   ]"></td><td><a href='11hz2.laz.zip'>11hz2.laz.zip</a></td><td align="right">2023-01-05 10:12  </td><td align="right">3.9M</td><td>&nbsp;</td></tr>
+   <tr><th colspan="5"><hr></th></tr>
+</table>
+</body></html>
+'''
+
+ATOM_FEED = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>AHN tiles</title>
+  <entry>
+    <title>11hz1</title>
+    <updated>2026-10-18T14:21:00Z</updated>
+    <link rel="enclosure" href="https://example.org/ahn/11hz1.laz.zip" length="3001150"/>
+  </entry>
+  <entry>
+    <title>11hz2</title>
+    <updated>2026-10-18T16:21:00+02:00</updated>
+    <link rel="enclosure" href="https://example.org/ahn/11hz2.laz.zip"/>
+  </entry>
+</feed>
+'''
+
+LOGIN_PAGE = '<html><body><form action="/login" method="post"><input name="user"></form></body></html>'
+
+
+class ListingResponse:
+
+    def __init__(self, body):
+        self.status = 200
+        self.reason = 'OK'
+        self.body = body.encode('utf-8')
+        self.headers = self
+
+    def get_content_charset(self):
+        return 'utf-8'
+
+    def read(self):
+        return self.body
+
+
+class ListingSession:
+
+    def __init__(self, body):
+        self.pool = self
+        self.body = body
+
+    @contextlib.contextmanager
+    def open(self, method, url):
+        yield ListingResponse(self.body)
+
+
+def test_nginx_listing():
+    listing = downloader.parse_listing(NGINX_LISTING)
+    assert listing == {'10hn2.laz.zip':{'size':4001452, 'lastModified':'Sun, 18 Oct 2026 14:04:00 GMT'},
+                       '11hz1.laz.zip':{'size':3001150, 'lastModified':'Thu, 05 Jan 2023 10:12:31 GMT'}}
+
+
+def test_apache_listing():
+    #rounded sizes cannot be compared with the local size and stay unknown
+    listing = downloader.parse_listing(APACHE_LISTING)
+    assert listing == {'11hz1.laz.zip':{'size':3001150, 'lastModified':'Thu, 05 Jan 2023 10:12:00 GMT'},
+                       '11hz2.laz.zip':{'size':None, 'lastModified':'Thu, 05 Jan 2023 10:12:00 GMT'}}
+
+
+def test_atom_feed():
+    listing = downloader.parse_listing(ATOM_FEED)
+    assert listing == {'11hz1.laz.zip':{'size':3001150, 'lastModified':'Sun, 18 Oct 2026 14:21:00 GMT'},
+                       '11hz2.laz.zip':{'size':None, 'lastModified':'Sun, 18 Oct 2026 14:21:00 GMT'}}
+
+
+def test_error_page_lists_nothing():
+    assert downloader.parse_listing(LOGIN_PAGE) == {}
+    assert downloader.fetch_remote_listing('https://example.org/ahn/', ListingSession(LOGIN_PAGE)) == None
+
+
+def test_fetch_remote_listing():
+    listing = downloader.fetch_remote_listing('https://example.org/ahn/', ListingSession(NGINX_LISTING))
+    assert sorted(listing) == ['10hn2.laz.zip', '11hz1.laz.zip']
@@ -0,0 +1,34 @@
+import downloader
+
+
+SHEET_INDEX = {11:(60000., 525000.), 25:(100000., 475000.)}
+
+
+def test_tile_bounds():
+    #H is the bottom right quarter of the right half, Z the bottom row, 1 the left column
+    assert downloader.tile_bounds('11HZ1', SHEET_INDEX) == (90000., 525000., 95000., 531250.)
+    assert downloader.tile_bounds('11AN2', SHEET_INDEX) == (65000., 543750., 70000., 550000.)
+    assert downloader.tile_bounds('25cz1', SHEET_INDEX) == (100000., 475000., 105000., 481250.)
+
+
+def test_tiles_in_region_exact_tile():
+    rings = downloader.parse_bbox('60000,525000,65000,531250')
+    assert downloader.tiles_in_region(rings, SHEET_INDEX) == ['11CZ1']
+
+
+def test_tiles_in_region_border_only():
+    #a box that only touches a tile along its border does not select it
+    rings = downloader.parse_bbox('55000,525000,60000,531250')
+    assert downloader.tiles_in_region(rings, SHEET_INDEX) == []
+    rings = downloader.parse_bbox('65000,520000,70000,525000')
+    assert downloader.tiles_in_region(rings, SHEET_INDEX) == []
+
+
+def test_tiles_in_region_spanning():
+    rings = downloader.parse_bbox('64000,530000,66000,532000')
+    assert downloader.tiles_in_region(rings, SHEET_INDEX) == ['11CN1', '11CN2', '11CZ1', '11CZ2']
+
+
+def test_tiles_in_region_whole_sheet():
+    rings = downloader.parse_bbox('60000,525000,100000,550000')
+    assert len(downloader.tiles_in_region(rings, SHEET_INDEX)) == 32
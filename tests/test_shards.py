@@ -0,0 +1,28 @@
+import random
+
+import downloader
+
+
+TILES = downloader.download_list_top10nl()[:200]
+
+
+def test_shards_independent_of_input_order():
+    tileSizes = {mapTile:(index*7919)%5000000+1000 for index, mapTile in enumerate(TILES)}
+    subMapLists = downloader.assign_shards(TILES, 4, tileSizes)
+    shuffledTiles = list(TILES)
+    random.Random(13).shuffle(shuffledTiles)
+    assert downloader.assign_shards(shuffledTiles, 4, tileSizes) == subMapLists
+    assert downloader.assign_shards(list(reversed(TILES)), 4, tileSizes) == subMapLists
+
+
+def test_shards_partition_the_tiles():
+    subMapLists = downloader.assign_shards(TILES, 3, {})
+    assert sorted(mapTile for subMapList in subMapLists for mapTile in subMapList) == sorted(TILES)
+    assert [len(subMapList) for subMapList in subMapLists] == [67, 67, 66]
+
+
+def test_shards_balance_sizes():
+    #largest first onto the least loaded shard; the unknown size counts as the median of the known ones, 600
+    tileSizes = {'11HZ1':900, '11HZ2':600, '43BN1':500, '43BN2':400, '10HN2':None}
+    subMapLists = downloader.assign_shards(['43BN2', '10HN2', '11HZ1', '43BN1', '11HZ2'], 2, tileSizes)
+    assert subMapLists == [['11HZ1', '43BN1'], ['10HN2', '11HZ2', '43BN2']]